@@ -1,7 +1,156 @@
-from app import webserver
-# Your code will go in the app/ directory.
-# Have a look in:
-#   * __init__.py
-#   * routes.py
-#   * data_ingestor.py
-#   * task_runner.py
+import argparse
+import importlib.util
+import os
+import secrets
+import signal
+import socket
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from threading import Thread
+
+
+def load_app_module(name):
+    '''
+    Load a module of the app package on its own. Importing the app package
+    builds the whole server, which the master process must not do before forking.
+    '''
+    spec = importlib.util.spec_from_file_location(name, Path(__file__).parent / 'app' / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+job_table_module = load_app_module('job_table')
+
+# Signals handled by the server processes, held back until they can handle them
+SERVER_SIGNALS = {signal.SIGUSR1, signal.SIGTERM, signal.SIGINT}
+
+# Job table shared in pre-fork mode, held by the master process
+shared_table = job_table_module.JobTable()
+
+class JobTableServer(BaseManager):
+    """
+    Serves the job table to the worker processes.
+    The name must match the one registered in app/job_table.py.
+    Each call runs in the master under the table's own lock.
+    """
+
+JobTableServer.register('get_table', callable=lambda: shared_table, exposed=job_table_module.PROXY_METHODS)
+
+
+def serve(server, stop_signals):
+    '''
+    Serve until one of stop_signals arrives, then drain the queue, save the
+    jobs still queued and stop. SIGUSR1 drains and saves the jobs without
+    stopping, as /api/graceful_shutdown does.
+    '''
+    from app.routes import drain_and_persist
+    timeout = float(os.environ.get('TP_SHUTDOWN_TIMEOUT', 10))
+
+    # Signal handlers run in the thread serving requests, which
+    # server.shutdown() waits for, so the work is done by another thread
+    def drain(signum, frame):
+        Thread(target=drain_and_persist, args=(timeout,)).start()
+
+    def drain_and_stop(signum, frame):
+        def stop():
+            try:
+                drain_and_persist(timeout)
+            finally:
+                server.shutdown()
+        Thread(target=stop).start()
+
+    signal.signal(signal.SIGUSR1, drain)
+    for signum in stop_signals:
+        signal.signal(signum, drain_and_stop)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, SERVER_SIGNALS)
+
+    server.serve_forever()
+
+
+def serve_worker(listener, host, port, index):
+    '''
+    Serve the app on the shared listening socket.
+    '''
+    from werkzeug.serving import make_server
+
+    # Ctrl-C reaches every process of the terminal, leave it to the master
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Each process persists its own queued jobs on graceful shutdown
+    os.environ['TP_WORKER_INDEX'] = str(index)
+
+    from app import webserver
+    server = make_server(host, port, webserver, threaded=True, fd=listener.fileno())
+    serve(server, (signal.SIGTERM,))
+
+
+def serve_prefork(host, port, num_workers):
+    '''
+    Serve the app from num_workers processes sharing one listening socket
+    and one job table.
+    '''
+    # Forking lets the workers inherit the listening socket and the job
+    # table server the objects above
+    fork = multiprocessing.get_context('fork')
+
+    # Jobs left by the previous run, whatever its mode and number of
+    # processes, are merged into one log that the first worker replays
+    job_log_module = load_app_module('job_log')
+    job_log_module.JobLog(os.environ.get('TP_JOB_LOG', './job_log.jsonl')).merge()
+
+    authkey = secrets.token_bytes(16)
+    job_table = JobTableServer(address=('127.0.0.1', 0), authkey=authkey, ctx=fork)
+    job_table.start()
+
+    os.environ['TP_JOB_TABLE'] = f"{job_table.address[0]}:{job_table.address[1]}"
+    os.environ['TP_JOB_TABLE_AUTHKEY'] = authkey.hex()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    os.environ['TP_MASTER_PID'] = str(os.getpid())
+
+    # The workers start with the signals blocked, and the master blocks them
+    # until it knows the workers to relay them to
+    signal.pthread_sigmask(signal.SIG_BLOCK, SERVER_SIGNALS)
+    workers = [fork.Process(target=serve_worker, args=(listener, host, port, index)) for index in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    def relay(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+
+    # A worker asks for SIGUSR1 when one of them gets /api/graceful_shutdown.
+    # On Ctrl-C or SIGTERM every worker drains, saves its jobs and exits.
+    signal.signal(signal.SIGUSR1, relay)
+    signal.signal(signal.SIGTERM, relay)
+    signal.signal(signal.SIGINT, lambda signum, frame: relay(signal.SIGTERM, frame))
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, SERVER_SIGNALS)
+
+    # The job table is needed until the workers are done draining
+    for worker in workers:
+        worker.join()
+    job_table.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the webserver.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help="number of pre-forked server processes")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        serve_prefork(args.host, args.port, args.workers)
+    else:
+        from werkzeug.serving import make_server
+        from app import webserver
+        serve(make_server(args.host, args.port, webserver, threaded=True), (signal.SIGTERM, signal.SIGINT))
+else:
+    from app import webserver
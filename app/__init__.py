@@ -1,12 +1,55 @@
+import os
 from flask import Flask
-from app.data_ingestor import DataIngestor
+from app.dataset_registry import DatasetRegistry
+from app.job_log import JobLog
+from app.job_table import JobTable
+from app.profiler import SamplingProfiler
 from app.task_runner import ThreadPool
 
 webserver = Flask(__name__)
-webserver.tasks_runner = ThreadPool()
 
-webserver.tasks_runner.start()
+# In pre-fork mode, the job table is shared through the master process
+if 'TP_JOB_TABLE' in os.environ:
+    host, port = os.environ['TP_JOB_TABLE'].rsplit(':', 1)
+    jobs = JobTable.connect((host, int(port)), bytes.fromhex(os.environ['TP_JOB_TABLE_AUTHKEY']))
+else:
+    jobs = JobTable()
+
+webserver.tasks_runner = ThreadPool(jobs)
+webserver.profiler = SamplingProfiler(webserver.tasks_runner)
+
+# Datasets are loaded on first use, within TP_DATASET_MEMORY_MB (0 for no limit)
+webserver.datasets = DatasetRegistry(int(os.environ.get('TP_DATASET_MEMORY_MB', 0)) * 1024 * 1024)
+if 'TP_DATASETS' in os.environ:
+    webserver.datasets.register_from_file(os.environ['TP_DATASETS'])
+else:
+    webserver.datasets.register("nutrition", "./nutrition_activity_obesity_usa_subset.csv")
+
+# In pre-fork mode every process saves the jobs it has queued to its own log.
+# The logs are merged back into the main log at the next start, by the master
+# process in pre-fork mode.
+worker_index = os.environ.get('TP_WORKER_INDEX')
+webserver.job_log = JobLog(os.environ.get('TP_JOB_LOG', './job_log.jsonl'), worker_index)
+if worker_index is None:
+    webserver.job_log.merge()
 
-webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
+from app import routes
+from app.task import restore_task
+from app.views import MaterializedViews
+
+# Queue again the jobs left over by the previous shutdown, before starting the
+# workers. In pre-fork mode the first process replays the jobs of all of them.
+replays_jobs = worker_index in (None, '0')
+id_counter, jobs = webserver.job_log.load() if replays_jobs else (0, [])
+restored_tasks = [(restore_task(job["task"], webserver.datasets), job["job_id"], job["deadline"]) for job in jobs]
+webserver.tasks_runner.restore(id_counter, [restored for restored in restored_tasks if restored[0] is not None])
+if replays_jobs:
+    webserver.job_log.discard_when_done(webserver.tasks_runner.jobs, [job["job_id"] for job in jobs])
+
+webserver.tasks_runner.start()
 
-from app import routes
\ No newline at end of file
+# Optionally precompute every endpoint result, kept up to date with the CSV file
+webserver.views = MaterializedViews(webserver.datasets)
+if os.environ.get('TP_MATERIALIZE', '0') == '1':
+    webserver.views.build()
+    webserver.views.start_refresher(float(os.environ.get('TP_VIEWS_REFRESH', 60)))
@@ -1,20 +1,72 @@
+import hashlib
+import os
+import sys
 import pandas as pd
+from app.quantile_sketch import QuantileSketch
+
+class Catalog:
+    """
+    Class numbering the questions and states of one version of a dataset.
+
+    The ids are the categorical codes of the data, so they only hold for
+    the version they were built from. A catalog is never changed: a reload
+    builds a new one, so the version and the ids always go together.
+    """
+    def __init__(self, version: str, questions: list, states: list):
+        """
+        Initialize the Catalog instance.
+
+        Args:
+            version (str): The version of the dataset.
+            questions (list): The questions, indexed by id.
+            states (list): The states, indexed by id.
+        """
+        self.version = version
+        self.questions = questions
+        self.question_ids = {question: index for index, question in enumerate(questions)}
+        self.states = states
+        self.state_ids = {state: index for index, state in enumerate(states)}
+
+    def get_question(self, question):
+        """
+        Get a question from its id, or return it as is if it is a string.
+        """
+        if isinstance(question, int) and not isinstance(question, bool):
+            return self.questions[question] if 0 <= question < len(self.questions) else None
+        return question if isinstance(question, str) else None
+
+    def get_state(self, state):
+        """
+        Get a state from its id, or return it as is if it is a string.
+        """
+        if isinstance(state, int) and not isinstance(state, bool):
+            return self.states[state] if 0 <= state < len(self.states) else None
+        return state if isinstance(state, str) else None
 
 class DataIngestor:
     """
     Class for ingesting data from a CSV file.
     """
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, name: str = 'default',
+                 questions_best_is_min: list = None, questions_best_is_max: list = None):
         """
         Initialize the DataIngestor instance.
 
         Args:
             csv_path (str): The path to the CSV file.
+            name (str): The name the dataset is registered under.
+            questions_best_is_min (list): Questions where a lower value is better,
+                the nutrition survey questions if not given.
+            questions_best_is_max (list): Questions where a higher value is better,
+                the nutrition survey questions if not given.
         """
-        # TODO: Read csv from csv_path
-        self.data = pd.read_csv(csv_path)
+        self.name = name
+        self.csv_path = csv_path
+        self.data = self.load_data()
+
+        self.file_stat = self.get_file_stat()
 
-        self.questions_best_is_min = [
+        self.questions_best_is_min = questions_best_is_min if questions_best_is_min is not None else [
             'Percent of adults aged 18 years and older who have an overweight classification',
             'Percent of adults aged 18 years and older who have obesity',
             'Percent of adults who engage in no leisure-time physical activity',
@@ -22,9 +74,145 @@ class DataIngestor:
             'Percent of adults who report consuming vegetables less than one time daily'
         ]
 
-        self.questions_best_is_max = [
+        self.questions_best_is_max = questions_best_is_max if questions_best_is_max is not None else [
             'Percent of adults who achieve at least 150 minutes a week of moderate-intensity aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic activity (or an equivalent combination)',
             'Percent of adults who achieve at least 150 minutes a week of moderate-intensity aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic physical activity and engage in muscle-strengthening activities on 2 or more days a week',
             'Percent of adults who achieve at least 300 minutes a week of moderate-intensity aerobic physical activity or 150 minutes a week of vigorous-intensity aerobic activity (or an equivalent combination)',
             'Percent of adults who engage in muscle-strengthening activities on 2 or more days a week',
         ]
+
+        # Sets of the questions above, for constant time validation
+        self.min_questions = frozenset(self.questions_best_is_min)
+        self.max_questions = frozenset(self.questions_best_is_max)
+        self.valid_questions = self.min_questions | self.max_questions
+
+        # Ids of the questions and states, along with the version of the
+        # dataset, which changes whenever the CSV content changes
+        self.catalog = self.build_catalog(self.get_version())
+
+        # Quantile sketches for every (question, state, category, stratification)
+        self.sketches = self.build_sketches()
+        # The same sketches merged per (question, state) and per question
+        self.state_sketches, self.question_sketches = self.merge_sketches(self.sketches)
+
+        self.memory_usage = self.get_memory_usage()
+
+    def load_data(self):
+        """
+        Read the CSV file, interning the text columns as categoricals so each
+        distinct string is stored once and rows compare by integer code.
+        """
+        data = pd.read_csv(self.csv_path)
+        for column in ('Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1'):
+            data[column] = data[column].astype('category')
+        return data
+
+    def build_catalog(self, version):
+        """
+        Number the questions and states of the data by their categorical codes.
+        """
+        return Catalog(version,
+                       list(self.data['Question'].cat.categories),
+                       list(self.data['LocationDesc'].cat.categories))
+
+    @property
+    def version(self):
+        """
+        Get the version of the loaded data.
+        """
+        return self.catalog.version
+
+    def get_memory_usage(self):
+        """
+        Get the number of bytes used by the data frame and the quantile sketches.
+        """
+        return (int(self.data.memory_usage(deep=True).sum()) +
+                sum(self.get_sketches_memory_usage(sketches)
+                    for sketches in (self.sketches, self.state_sketches, self.question_sketches)))
+
+    def get_sketches_memory_usage(self, sketches):
+        """
+        Estimate the number of bytes used by nested dicts of sketches. Key
+        strings are shared with the data frame categories and not counted.
+        """
+        if isinstance(sketches, QuantileSketch):
+            return sketches.memory_usage()
+
+        return (sys.getsizeof(sketches) +
+                sum(sys.getsizeof(key) for key in sketches if isinstance(key, tuple)) +
+                sum(self.get_sketches_memory_usage(value) for value in sketches.values()))
+
+    def get_file_stat(self):
+        """
+        Get the modification time and size of the CSV file.
+        """
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_version(self):
+        """
+        Get a content hash of the CSV file.
+        """
+        digest = hashlib.sha1()
+        with open(self.csv_path, mode='rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:16]
+
+    def refresh(self):
+        """
+        Reload the data if the CSV file changed since it was read.
+
+        Returns True if the data was reloaded.
+        """
+        file_stat = self.get_file_stat()
+        if file_stat == self.file_stat:
+            return False
+
+        self.file_stat = file_stat
+        version = self.get_version()
+        if version == self.version:
+            return False
+
+        self.data = self.load_data()
+        self.sketches = self.build_sketches()
+        self.state_sketches, self.question_sketches = self.merge_sketches(self.sketches)
+        self.memory_usage = self.get_memory_usage()
+        # Swapped last and in one go, so anything tied to the old version
+        # stays valid until now and no reader sees ids of the other version
+        self.catalog = self.build_catalog(version)
+        return True
+
+    def build_sketches(self, relative_accuracy=0.01):
+        """
+        Precompute a quantile sketch for every (question, state, category,
+        stratification) group of the data.
+
+        The sketches are nested as question -> state -> (category, stratification),
+        so all sketches of a question or of a state can be found directly.
+
+        Args:
+            relative_accuracy (float): Relative error bound of the sketches.
+        """
+        sketches = {}
+        group_columns = ['Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1']
+        for (question, state, category, segment), group_data in self.data.groupby(group_columns, dropna=False, observed=True):
+            state_sketches = sketches.setdefault(question, {}).setdefault(state, {})
+            state_sketches[(category, segment)] = QuantileSketch.from_values(group_data['Data_Value'],
+                                                                             relative_accuracy)
+        return sketches
+
+    def merge_sketches(self, sketches):
+        """
+        Merge the group sketches of every (question, state) and of every
+        question, so a quantile request reads a single sketch.
+
+        Returns the question -> state -> sketch and question -> sketch dicts.
+        """
+        state_sketches = {}
+        question_sketches = {}
+        for question, question_groups in sketches.items():
+            state_sketches[question] = {state: QuantileSketch.merged(groups.values())
+                                        for state, groups in question_groups.items()}
+            question_sketches[question] = QuantileSketch.merged(state_sketches[question].values())
+        return state_sketches, question_sketches
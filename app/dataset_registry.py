@@ -0,0 +1,172 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from app.data_ingestor import DataIngestor
+
+class DatasetHandle:
+    """
+    Class standing for a registered dataset, loaded when first read.
+
+    Tasks hold a handle rather than the dataset, so queued tasks neither load
+    a dataset before they run nor keep an evicted one in memory.
+    """
+    def __init__(self, datasets, name):
+        """
+        Initialize the DatasetHandle instance.
+
+        Args:
+            datasets (DatasetRegistry): The registry the dataset is in.
+            name (str): The dataset name.
+        """
+        self.datasets = datasets
+        self.name = name
+
+    def __getattr__(self, attribute):
+        """
+        Read an attribute of the dataset, loading it if needed.
+        """
+        data_ingestor = self.datasets.get(self.name)
+        if data_ingestor is None:
+            raise LookupError(f"Dataset {self.name} is no longer registered")
+        return getattr(data_ingestor, attribute)
+
+class DatasetRegistry:
+    """
+    Class for serving several datasets by name.
+
+    Datasets are loaded on first use and the least recently used ones are
+    evicted when the loaded datasets exceed the memory budget.
+    """
+    def __init__(self, memory_budget: int = 0):
+        """
+        Initialize the DatasetRegistry instance.
+
+        Args:
+            memory_budget (int): Bytes the loaded datasets may use, 0 for no limit.
+        """
+        self.memory_budget = memory_budget
+        self.configs = {}  # name -> DataIngestor arguments
+        self.loaded = OrderedDict()  # name -> DataIngestor, least recently used first
+        self.load_locks = {}  # name -> Lock, so a dataset is only loaded once at a time
+        self.lock = Lock()
+        self.default = None
+
+    def register(self, name, csv_path, questions_best_is_min=None, questions_best_is_max=None):
+        """
+        Register a dataset. The first registered dataset is the default one.
+        """
+        self.configs[name] = {"csv_path": csv_path, "name": name,
+                              "questions_best_is_min": questions_best_is_min,
+                              "questions_best_is_max": questions_best_is_max}
+        self.load_locks[name] = Lock()
+        if self.default is None:
+            self.default = name
+
+    def register_from_file(self, config_path):
+        """
+        Register the datasets of a JSON file mapping dataset names to
+        {"path", "questions_best_is_min", "questions_best_is_max"} objects.
+        """
+        with open(config_path, mode='r', encoding='utf-8') as file:
+            config = json.load(file)
+
+        for name, dataset in config.items():
+            self.register(name, dataset["path"],
+                          dataset.get("questions_best_is_min"), dataset.get("questions_best_is_max"))
+
+    def get(self, name=None):
+        """
+        Get a dataset, loading it if needed. Returns None for unknown names.
+
+        Args:
+            name (str): The dataset name, the default dataset if None.
+        """
+        name = name if name is not None else self.default
+        if name not in self.configs:
+            return None
+
+        data_ingestor = self.peek(name)
+        if data_ingestor is not None:
+            return data_ingestor
+
+        with self.load_locks[name]:
+            # Another request may have loaded it while we waited
+            data_ingestor = self.peek(name)
+            if data_ingestor is not None:
+                return data_ingestor
+
+            data_ingestor = DataIngestor(**self.configs[name])
+
+            with self.lock:
+                self.loaded[name] = data_ingestor
+                self.evict()
+
+        return data_ingestor
+
+    def handle(self, name=None):
+        """
+        Get a handle on a dataset, without loading it. Returns None for
+        unknown names.
+
+        Args:
+            name (str): The dataset name, the default dataset if None.
+        """
+        name = name if name is not None else self.default
+        if name not in self.configs:
+            return None
+
+        return DatasetHandle(self, name)
+
+    def peek(self, name=None, touch=True):
+        """
+        Get a dataset only if it is loaded.
+
+        Args:
+            name (str): The dataset name, the default dataset if None.
+            touch (bool): Whether to mark the dataset as recently used.
+        """
+        name = name if name is not None else self.default
+        with self.lock:
+            data_ingestor = self.loaded.get(name)
+            if data_ingestor is not None and touch:
+                self.loaded.move_to_end(name)
+            return data_ingestor
+
+    def refresh(self, name=None):
+        """
+        Reload a loaded dataset if its CSV file changed, then evict datasets
+        if its new size exceeds the memory budget.
+
+        Returns True if the dataset was reloaded.
+        """
+        data_ingestor = self.peek(name, touch=False)
+        if data_ingestor is None or not data_ingestor.refresh():
+            return False
+
+        with self.lock:
+            self.evict()
+        return True
+
+    def evict(self):
+        """
+        Drop the least recently used datasets until the memory budget is met,
+        always keeping the most recent one. Must be called with the lock held.
+        """
+        if not self.memory_budget:
+            return
+
+        memory_usage = sum(data_ingestor.memory_usage for data_ingestor in self.loaded.values())
+        while memory_usage > self.memory_budget and len(self.loaded) > 1:
+            _, data_ingestor = self.loaded.popitem(last=False)
+            memory_usage -= data_ingestor.memory_usage
+
+    def describe(self):
+        """
+        Get the registered datasets with their load state and memory usage.
+        """
+        with self.lock:
+            return [{"name": name,
+                     "loaded": name in self.loaded,
+                     "memory_usage": self.loaded[name].memory_usage if name in self.loaded else 0,
+                     "default": name == self.default}
+                    for name in self.configs]
@@ -0,0 +1,128 @@
+import glob
+import json
+import os
+import time
+from threading import Lock, Thread
+
+class JobLog:
+    """
+    Class for persisting queued jobs across restarts.
+
+    The log is a JSON lines file: a header line with the job id counter,
+    then one line per queued job. It is kept until the jobs read from it are
+    finished, so they are replayed again if the server stops before that.
+
+    In pre-fork mode every server process saves its jobs to its own log,
+    path.<index>, and merge() folds them back into the log at path.
+    """
+    def __init__(self, path: str, index: str = None):
+        """
+        Initialize the JobLog instance.
+
+        Args:
+            path (str): The path to the log file.
+            index (str): The index of this server process in pre-fork mode.
+        """
+        self.path = path
+        self.save_path = path if index is None else f"{path}.{index}"
+        self.lock = Lock()  # Orders saving and discarding the log
+        self.saved = False  # Set once the log is written by this process
+
+    def save(self, id_counter, jobs):
+        """
+        Write the job id counter and the queued jobs to the log of this process.
+        """
+        with self.lock:
+            self.write(self.save_path, id_counter, jobs)
+            self.saved = True
+
+    def write(self, path, id_counter, jobs):
+        """
+        Write a log.
+
+        The log is written to a temporary file first and then renamed, so a
+        crash while saving never leaves a truncated log behind.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as file:
+            file.write(json.dumps({"id_counter": id_counter}) + "\n")
+            for job in jobs:
+                file.write(json.dumps(job) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, path)
+
+    def read(self, path):
+        """
+        Read a log, returning its job id counter and queued jobs.
+        """
+        if not os.path.exists(path):
+            return 0, []
+
+        with open(path, mode='r', encoding='utf-8') as file:
+            id_counter = json.loads(file.readline())["id_counter"]
+            jobs = [json.loads(line) for line in file if line.strip()]
+
+        return id_counter, jobs
+
+    def merge(self):
+        """
+        Fold the logs saved by the processes of a pre-fork run into the log
+        at path, whatever the number of processes of that run.
+
+        Must be called before any process of the new run may save its log.
+        """
+        paths = [path for path in glob.glob(f"{glob.escape(self.path)}.*")
+                 if path[len(self.path) + 1:].isdigit()]
+        if not paths:
+            return
+
+        id_counter, jobs = self.read(self.path)
+        for path in paths:
+            path_id_counter, path_jobs = self.read(path)
+            id_counter = max(id_counter, path_id_counter)
+            jobs += path_jobs
+
+        # A crash after a previous merge may have left a job in two logs
+        jobs = list({job["job_id"]: job for job in jobs}.values())
+        self.write(self.path, id_counter, sorted(jobs, key=lambda job: job["job_id"]))
+        for path in paths:
+            os.remove(path)
+
+    def load(self):
+        """
+        Read the log, returning the job id counter and the queued jobs.
+
+        The log stays on disk, see discard_when_done().
+        """
+        return self.read(self.path)
+
+    def discard(self):
+        """
+        Remove the log read by load(), unless this process saved it again since.
+        """
+        with self.lock:
+            if not (self.saved and self.save_path == self.path) and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def discard_when_done(self, jobs, job_ids, interval=0.5):
+        """
+        Remove the log in the background once none of the jobs replayed from
+        it is queued or running anymore.
+
+        Args:
+            jobs (JobTable): The table the replayed jobs are in.
+            job_ids (list): The ids of the replayed jobs.
+            interval (float): Seconds between two checks of the jobs.
+        """
+        def wait():
+            pending = list(job_ids)
+            while pending:
+                pending = [job_id for job_id in pending
+                           if (jobs.get(job_id) or {}).get("status") in ("queued", "running")]
+                if pending:
+                    time.sleep(interval)
+            self.discard()
+
+        Thread(target=wait, daemon=True).start()
@@ -0,0 +1,169 @@
+import bisect
+from multiprocessing.managers import BaseManager
+from threading import Lock
+
+STATUSES = ("queued", "running", "done", "expired", "cancelled", "error")
+
+# Methods of the table callable through a proxy, each one a single round trip
+PROXY_METHODS = ('add', 'last_id', 'reserve_ids', 'get', 'set', 'transition', 'delete', 'count', 'counts',
+                 'list_jobs')
+
+class JobTableManager(BaseManager):
+    """
+    Client side of the job table served by the pre-fork master process.
+    The master registers the same name with its JobTable.
+    """
+
+JobTableManager.register('get_table')
+
+class JobTable:
+    """
+    Class holding the status and result of every job.
+
+    The table lives in this process by default. In pre-fork mode it lives in
+    the master process and the server processes call its methods through a
+    proxy, so every server process sees the same job ids and statuses.
+
+    Every status has an index of the ids of the jobs currently in it, kept
+    sorted and updated along with the jobs, so counting the jobs of a status
+    and listing a page of them does not go through the whole table.
+    """
+    def __init__(self):
+        """
+        Initialize an empty JobTable.
+        """
+        self.jobs = {}  # job id -> {"status", "result", ...}
+        self.ids = []  # Sorted ids of every job
+        self.index = {status: [] for status in STATUSES}  # status -> sorted job ids
+        self.id_counter = 0  # Last job id given
+        self.lock = Lock()  # Guards job id allocation and status transitions
+
+    @staticmethod
+    def connect(address, authkey):
+        """
+        Connect to the job table served by the pre-fork master process.
+
+        Returns a proxy with the PROXY_METHODS of the table.
+        """
+        manager = JobTableManager(address=address, authkey=authkey)
+        manager.connect()
+        return manager.get_table()
+
+    def add(self, info):
+        """
+        Allocate a new job id and set the info of the job.
+
+        Returns the job id.
+        """
+        with self.lock:
+            self.id_counter += 1
+            self.store(self.id_counter, info)
+            return self.id_counter
+
+    def last_id(self):
+        """
+        Get the last job id given.
+        """
+        return self.id_counter
+
+    def reserve_ids(self, id_counter):
+        """
+        Make sure ids up to id_counter are never given again.
+        """
+        with self.lock:
+            self.id_counter = max(self.id_counter, id_counter)
+
+    def get(self, job_id):
+        """
+        Get the info of a job, or None if it does not exist.
+        """
+        return self.jobs.get(job_id)
+
+    def set(self, job_id, info):
+        """
+        Set the info of a job.
+        """
+        with self.lock:
+            self.store(job_id, info)
+
+    def transition(self, job_id, from_status, info):
+        """
+        Set the info of a job only if its status is from_status.
+
+        Returns True if the job was updated.
+        """
+        with self.lock:
+            job_info = self.jobs.get(job_id)
+            if job_info is None or job_info["status"] != from_status:
+                return False
+
+            self.store(job_id, info)
+            return True
+
+    def delete(self, job_id):
+        """
+        Remove a job from the table.
+        """
+        with self.lock:
+            job_info = self.jobs.pop(job_id, None)
+            if job_info is not None:
+                self.remove_id(self.ids, job_id)
+                self.remove_id(self.index[job_info["status"]], job_id)
+
+    def store(self, job_id, info):
+        """
+        Set the info of a job and move it to the index of its new status.
+        Must be called with the lock held.
+        """
+        job_info = self.jobs.get(job_id)
+        self.jobs[job_id] = info
+        if job_info is None:
+            bisect.insort(self.ids, job_id)
+        elif job_info["status"] != info["status"]:
+            self.remove_id(self.index[job_info["status"]], job_id)
+        else:
+            return
+
+        bisect.insort(self.index[info["status"]], job_id)
+
+    @staticmethod
+    def remove_id(ids, job_id):
+        """
+        Remove an id from a sorted list of ids.
+        """
+        position = bisect.bisect_left(ids, job_id)
+        if position < len(ids) and ids[position] == job_id:
+            del ids[position]
+
+    def count(self, status):
+        """
+        Get the number of jobs in a status.
+        """
+        return len(self.index[status])
+
+    def counts(self):
+        """
+        Get the number of jobs in every status.
+        """
+        return {status: self.count(status) for status in STATUSES}
+
+    def list_jobs(self, status=None, cursor=0, limit=100):
+        """
+        Get the jobs with an id above cursor, in id order.
+
+        Args:
+            status (str): Only list jobs in this status, all jobs if None.
+            cursor (int): The last job id of the previous page, 0 to start.
+            limit (int): Maximum number of jobs listed.
+
+        Returns a ([(job id, status)], next cursor) tuple, the cursor being
+        None on the last page.
+        """
+        with self.lock:
+            ids = self.index[status] if status is not None else self.ids
+            start = bisect.bisect_right(ids, cursor)
+            job_ids = ids[start:start + limit + 1]
+            jobs = [(job_id, self.jobs[job_id]["status"]) for job_id in job_ids[:limit]]
+
+        next_cursor = job_ids[limit - 1] if len(job_ids) > limit else None
+        return jobs, next_cursor
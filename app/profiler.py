@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+from collections import Counter
+from threading import Lock
+
+class SamplingProfiler:
+    """
+    Class for sampling the stacks of the TaskRunner threads on demand.
+
+    Nothing runs while no profile is requested: the workers are not
+    instrumented, the stacks are read from outside by the thread serving
+    the profile request.
+    """
+    def __init__(self, pool):
+        """
+        Initialize the SamplingProfiler instance.
+
+        Args:
+            pool (ThreadPool): The pool whose workers are sampled.
+        """
+        self.pool = pool
+        self.busy = Lock()  # Only one profile at a time
+
+    def profile(self, duration, interval):
+        """
+        Sample the workers every interval seconds for duration seconds.
+
+        Returns the samples in collapsed-stack format ("root;frame;frame count"
+        lines), with the type of the task being executed as root frame, or
+        None if another profile is already running.
+        """
+        if not self.busy.acquire(blocking=False):
+            return None
+
+        try:
+            samples = Counter()
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                self.sample(samples)
+                time.sleep(interval)
+        finally:
+            self.busy.release()
+
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(samples.items()))
+
+    def sample(self, samples):
+        """
+        Add the current stack of every worker to the samples.
+        """
+        with self.pool.lock:
+            idents = {worker.ident for worker in self.pool.threads.values()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident not in idents:
+                continue
+
+            stack = []
+            root = "idle"
+            while frame is not None:
+                code = frame.f_code
+                if code.co_name == "execute_task" and "task" in frame.f_locals:
+                    root = type(frame.f_locals["task"]).__name__
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            stack.append(root)
+            samples[";".join(reversed(stack))] += 1
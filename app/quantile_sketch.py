@@ -0,0 +1,173 @@
+import math
+import sys
+import numpy as np
+
+# Estimated bytes of one bucket: its dict slot and its index int (counts
+# are mostly small, cached ints)
+BUCKET_BYTES = 8 * 3 + sys.getsizeof(2**30)
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error guarantee (DDSketch).
+
+    Values are counted in logarithmically sized buckets, so any quantile
+    returned by the sketch is within `relative_accuracy` of the exact
+    value: for the true q-quantile x, the estimate lies in
+    [x * (1 - relative_accuracy), x * (1 + relative_accuracy)].
+    Two sketches built with the same accuracy can be merged by adding
+    their bucket counts, which gives exactly the sketch of the union.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        """
+        Initialize an empty sketch.
+
+        Args:
+            relative_accuracy (float): Maximum relative error of any quantile.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.positive = {}  # bucket index -> count
+        self.negative = {}  # bucket index of -value -> count
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket_index(self, value):
+        """
+        Get the bucket index of a strictly positive value.
+        """
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def bucket_value(self, index):
+        """
+        Get the representative value of a bucket.
+        """
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """
+        Add a value to the sketch. NaN values are ignored.
+        """
+        if value != value:
+            return
+
+        if value > 0:
+            index = self.bucket_index(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < 0:
+            index = self.bucket_index(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero_count += count
+
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def memory_usage(self):
+        """
+        Estimate the number of bytes used by the sketch.
+        """
+        buckets = len(self.positive) + len(self.negative)
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.positive) +
+                sys.getsizeof(self.negative) + buckets * BUCKET_BYTES)
+
+    def quantile(self, q):
+        """
+        Get the estimated q-quantile, or None if the sketch is empty.
+
+        The rank is floor(q * (count - 1)), the same element pandas returns
+        with interpolation='lower'; the estimate is within the relative
+        accuracy of that element.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+
+        # Negative values, from the most negative up
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self.bucket_value(index), self.min)
+
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self.bucket_value(index), self.max)
+
+        return self.max
+
+    def add_values(self, values):
+        """
+        Add an array of values to the sketch in bulk. NaN values are ignored.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+
+        for store, part in ((self.positive, values[values > 0]),
+                            (self.negative, -values[values < 0])):
+            if part.size == 0:
+                continue
+            indexes, counts = np.unique(np.ceil(np.log(part) / self.log_gamma).astype(np.int64),
+                                        return_counts=True)
+            for index, count in zip(indexes.tolist(), counts.tolist()):
+                store[index] = store.get(index, 0) + count
+
+        self.zero_count += int((values == 0).sum())
+        self.count += int(values.size)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @classmethod
+    def from_values(cls, values, relative_accuracy=0.01):
+        """
+        Build a sketch from an array of values.
+        """
+        sketch = cls(relative_accuracy)
+        sketch.add_values(values)
+        return sketch
+
+    @classmethod
+    def merged(cls, sketches, relative_accuracy=0.01):
+        """
+        Build a new sketch from the union of several sketches.
+        """
+        result = cls(relative_accuracy)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
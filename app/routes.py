@@ -1,6 +1,11 @@
+import json
+import os
+import signal
+import sys
 from app import webserver
-from flask import request, jsonify
+from flask import request, jsonify, abort, make_response, Response
 from app.task import *
+from app.job_table import STATUSES
 from flask import current_app
 
 @webserver.route('/api/post_endpoint', methods=['POST'])
@@ -20,45 +25,208 @@ def post_endpoint():
 def get_response(job_id):
     '''
     Get the response of a job.
+
+    With ?format=ndjson the result is streamed as one {"key", "value"} line
+    per row, as soon as the task starts producing rows. With ?cursor= and/or
+    ?limit= a page of rows is returned along with the cursor of the next one.
     '''
+    if not job_id.isdigit():
+        return jsonify({"status": "not_found"}), 404
+
     job_id = int(job_id)
-    task_info = current_app.tasks_runner.dictionary.get(job_id)
+    tasks_runner = current_app.tasks_runner
+    task_info = tasks_runner.jobs.get(job_id)
+
+    if task_info is None:
+        # The job may have finished before the last restart
+        task_info = tasks_runner.load_result(job_id)
 
     if task_info:
         status = task_info["status"]
-        if status == "running":
+        streamed = task_info.get("streamed", False)
+        rows_result = streamed or isinstance(task_info["result"], dict)
+
+        if request.args.get('format') == 'ndjson' and rows_result and status in ("running", "done"):
+            if streamed:
+                lines = tasks_runner.stream_result(job_id)
+            else:
+                lines = (json.dumps({"key": key, "value": value}) + "\n"
+                         for key, value in task_info["result"].items())
+            return Response(lines, mimetype='application/x-ndjson')
+
+        if status in ("queued", "running"):
             return jsonify({'status': 'running'}), 200
         elif status == "done":
+            if rows_result and ('cursor' in request.args or 'limit' in request.args):
+                cursor = max(request.args.get('cursor', 0, type=int), 0)
+                limit = min(max(request.args.get('limit', 100, type=int), 1), 10000)
+                try:
+                    rows, next_cursor = tasks_runner.result_page(job_id, task_info, cursor, limit)
+                except ValueError:
+                    return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+                return jsonify({"status": "done", "data": dict(rows), "next_cursor": next_cursor}), 200
+
+            if streamed:
+                rows, _ = tasks_runner.result_page(job_id, task_info, 0, sys.maxsize)
+                return jsonify({"status": "done", "data": dict(rows)}), 200
+
             return jsonify({"status": "done", "data": task_info["result"]}), 200
+        elif status in ("expired", "cancelled", "error"):
+            return jsonify({"status": status}), 200
     # If the job id is not found or the task is not completed, return 404
     return jsonify({"status": "not_found"}), 404
 
 
+@webserver.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    '''
+    Cancel a job that is still waiting in the queue.
+    '''
+    status = current_app.tasks_runner.cancel_task(int(job_id)) if job_id.isdigit() else None
+
+    if status is None:
+        return jsonify({"status": "not_found"}), 404
+    if status != "cancelled":
+        # The job already started or finished, it can no longer be cancelled
+        return jsonify({"status": status, "message": "Job is no longer queued"}), 409
+
+    return jsonify({"status": "cancelled"}), 200
+
+
+@webserver.route('/api/views/<endpoint>', methods=['GET'])
+def get_view(endpoint):
+    '''
+    Gets the materialized result of an endpoint, revalidated by ETag.
+    '''
+    _, catalog = get_data_ingestor(request.args)
+    question = catalog.get_question(parse_id(request.args.get('question')))
+    state = catalog.get_state(parse_id(request.args.get('state')))
+
+    view = current_app.views.get(endpoint, question, state, request.args.get('dataset'))
+    if view is None:
+        return jsonify({"status": "not_found"}), 404
+
+    etag, result = view
+    response = jsonify({"status": "done", "data": result})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+
+    # Answers 304 Not Modified when If-None-Match matches the ETag
+    return response.make_conditional(request)
+
+
+@webserver.route('/api/catalog', methods=['GET'])
+def get_catalog():
+    '''
+    Lists the ids that requests may send instead of full questions and states.
+    '''
+    _, catalog = get_data_ingestor(request.args)
+
+    return jsonify({"status": "success",
+                    "version": catalog.version,
+                    "questions": [{"id": index, "question": question}
+                                  for index, question in enumerate(catalog.questions)],
+                    "states": [{"id": index, "state": state}
+                               for index, state in enumerate(catalog.states)]})
+
+
+@webserver.route('/api/datasets', methods=['GET'])
+def get_datasets():
+    '''
+    Lists the registered datasets.
+    '''
+    return jsonify({"status": "success", "datasets": current_app.datasets.describe()})
+
+
 @webserver.route('/api/jobs', methods=['GET'])
 def get_job_statuses():
     '''
     Gets status for jobs.
+
+    Jobs are listed in id order, a page at a time: ?status= keeps only the
+    jobs in that status, ?cursor= is the next_cursor of the previous page
+    and ?limit= the page size.
     '''
-    # Build a list of dictionaries for each job_id and its status
-    jobs = []
-    for job_id, job_info in current_app.tasks_runner.dictionary.items():
-        jobs.append({"job_id": job_id, "status": job_info["status"]})
+    jobs_table = current_app.tasks_runner.jobs
+    status = request.args.get('status')
+    if status is not None and status not in STATUSES:
+        return jsonify({"status": "error", "message": "Invalid status"}), 400
+
+    cursor = max(request.args.get('cursor', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 10000)
+    jobs, next_cursor = jobs_table.list_jobs(status, cursor, limit)
 
-    return (lambda jobs: jsonify({"status": "success", "jobs": jobs}))
+    return jsonify({"status": "success",
+                    "jobs": [{"job_id": job_id, "status": job_status} for job_id, job_status in jobs],
+                    "next_cursor": next_cursor})
 
 @webserver.route('/api/num_jobs', methods=['GET'])
 def get_remaining_jobs_count():
     '''
-    Gets all the jobs that are left.
+    Gets all the jobs that are left, along with the number of jobs in every status.
     '''
-    # Get the number of jobs to be completed from the task runner
-    num_jobs = current_app.tasks_runner.task_queue.qsize()
+    counts = current_app.tasks_runner.jobs.counts()
 
-    response_data = {"status": "success", "remaining_jobs": num_jobs}
+    response_data = {"status": "success", "remaining_jobs": counts["queued"] + counts["running"], **counts}
 
     return jsonify(response_data)
 
 
+def parse_id(value):
+    '''
+    Turn a query string value made of digits into an int id.
+    '''
+    return int(value) if value is not None and value.isdigit() else value
+
+
+def get_data_ingestor(data):
+    '''
+    Get the dataset selected by the request's "dataset", the default one if
+    it has none. Aborts with 400 for unknown datasets.
+
+    Question and state ids only hold for one version of a dataset, so a
+    request may send the catalog "version" its ids come from. It is
+    rejected with 400 if the dataset was reloaded since.
+
+    Returns a handle on the dataset for the tasks, which read the data when
+    they run, and the catalog of the dataset, read once so the version
+    checked and the ids resolved come from the same version.
+    '''
+    data_ingestor = current_app.datasets.get(data.get('dataset'))
+    if data_ingestor is None:
+        abort(make_response(jsonify({"status": "error", "message": "Invalid dataset"}), 400))
+
+    catalog = data_ingestor.catalog
+    version = data.get('version')
+    if version is not None and version != catalog.version:
+        abort(make_response(jsonify({"status": "error", "message": "Dataset version mismatch",
+                                     "version": catalog.version}), 400))
+
+    return current_app.datasets.handle(data_ingestor.name), catalog
+
+
+def submit_task(task, data):
+    '''
+    Add a task to the task queue and acknowledge the request.
+
+    The request may carry a "timeout" in seconds, after which the job
+    is skipped instead of being run.
+    '''
+    timeout = data.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+        return jsonify({"status": "error", "message": "Invalid timeout"}), 400
+
+    # Answer from the materialized views when possible, skipping the queue
+    view = current_app.views.get_for_task(task)
+    if view is not None:
+        job_id = current_app.tasks_runner.add_result(view[1])
+    else:
+        job_id = current_app.tasks_runner.add_task(task, timeout)
+
+    if job_id is None:
+        return jsonify({"status": "error", "message": "Server is shutting down"}), 503
+
+    return jsonify({"status": "success", "job_id": job_id}), 202
 
 
 @webserver.route('/api/states_mean', methods=['POST'])
@@ -68,15 +236,13 @@ def request_states_mean():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateStatesMeanTask(data['question'], current_app.data_ingestor.data)
-
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    task = CalculateStatesMeanTask(catalog.get_question(data['question']), data_ingestor)
 
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 @webserver.route('/api/state_mean', methods=['POST'])
 def state_mean_request():
@@ -85,15 +251,15 @@ def state_mean_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateMeanTask(data['question'], data['state'], current_app.data_ingestor.data)
-
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    task = CalculateMeanTask(catalog.get_question(data['question']),
+                             catalog.get_state(data['state']),
+                             data_ingestor)
 
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 @webserver.route('/api/best5', methods=['POST'])
 def best5_request():
@@ -102,15 +268,13 @@ def best5_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateBest5Task(data['question'], current_app.data_ingestor.data)
+    task = CalculateBest5Task(catalog.get_question(data['question']), data_ingestor)
 
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
-    
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 
@@ -121,15 +285,13 @@ def worst5_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateWorst5Task(data['question'], current_app.data_ingestor.data)
-
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    task = CalculateWorst5Task(catalog.get_question(data['question']), data_ingestor)
 
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 @webserver.route('/api/global_mean', methods=['POST'])
@@ -139,15 +301,13 @@ def global_mean_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateGlobalMeanTask(data['question'], current_app.data_ingestor.data)
+    task = CalculateGlobalMeanTask(catalog.get_question(data['question']), data_ingestor)
 
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
-
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 @webserver.route('/api/diff_from_mean', methods=['POST'])
@@ -157,17 +317,13 @@ def diff_from_mean_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateDiffFromMeanTask(data['question'], current_app.data_ingestor.data)
-
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    task = CalculateDiffFromMeanTask(catalog.get_question(data['question']), data_ingestor)
 
-    # Return response to acknowledge receival of request
-    response_data = {"status": "success", "job_id": job_id}
-    
-    return jsonify(response_data), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 
@@ -179,15 +335,15 @@ def state_diff_from_mean_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateStateDiffFromMeanTask(data['question'], data['state'], current_app.data_ingestor.data)
+    task = CalculateStateDiffFromMeanTask(catalog.get_question(data['question']),
+                                          catalog.get_state(data['state']),
+                                          data_ingestor)
 
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
-
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 @webserver.route('/api/mean_by_category', methods=['POST'])
@@ -197,15 +353,13 @@ def mean_by_category_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateMeanByCategoryTask(data['question'], current_app.data_ingestor.data)
-
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    task = CalculateMeanByCategoryTask(catalog.get_question(data['question']), data_ingestor)
 
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
 
 @webserver.route('/api/state_mean_by_category', methods=['POST'])
@@ -215,28 +369,120 @@ def state_mean_by_category_request():
     '''
     # Get data
     data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
 
     # Create Task object for the request
-    task = CalculateStateMeanByCategoryTask(data['question'], data['state'], current_app.data_ingestor.data)
+    task = CalculateStateMeanByCategoryTask(catalog.get_question(data['question']),
+                                            catalog.get_state(data['state']),
+                                            data_ingestor)
 
-    # Add task to the task queue
-    job_id = current_app.tasks_runner.add_task(task)
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
 
-    # Return response to acknowledge receival of request
-    return jsonify({"status": "success", "job_id": job_id}), 202
 
+@webserver.route('/api/state_quantile', methods=['POST'])
+def state_quantile_request():
+    '''
+    Gets a quantile (median by default) from a state.
+    '''
+    # Get data
+    data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
+
+    # Create Task object for the request
+    task = CalculateStateQuantileTask(catalog.get_question(data['question']),
+                                      catalog.get_state(data['state']),
+                                      data.get('quantile', 0.5),
+                                      data_ingestor)
 
-@webserver.route('/api/graceful_shutdown', methods=['GET'])
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
+
+
+@webserver.route('/api/states_quantile', methods=['POST'])
+def states_quantile_request():
+    '''
+    Gets a quantile (median by default) for all the states.
+    '''
+    # Get data
+    data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
+
+    # Create Task object for the request
+    task = CalculateStatesQuantileTask(catalog.get_question(data['question']),
+                                       data.get('quantile', 0.5),
+                                       data_ingestor)
 
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
+
+
+@webserver.route('/api/global_quantile', methods=['POST'])
+def global_quantile_request():
+    '''
+    Gets a quantile (median by default) over all the states.
+    '''
+    # Get data
+    data = request.json
+    data_ingestor, catalog = get_data_ingestor(data)
+
+    # Create Task object for the request
+    task = CalculateGlobalQuantileTask(catalog.get_question(data['question']),
+                                       data.get('quantile', 0.5),
+                                       data_ingestor)
+
+    # Add task to the task queue and acknowledge receival of request
+    return submit_task(task, data)
+
+
+@webserver.route('/api/admin/profile', methods=['GET'])
+def profile_request():
+    '''
+    Samples the worker threads and returns flamegraph-compatible collapsed stacks.
+    '''
+    duration = request.args.get('duration', 5, type=float)
+    interval = request.args.get('interval', 0.01, type=float)
+    if not 0 < duration <= 60 or not 0.001 <= interval <= duration:
+        return jsonify({"status": "error", "message": "Invalid duration or interval"}), 400
+
+    collapsed = current_app.profiler.profile(duration, interval)
+    if collapsed is None:
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@webserver.route('/api/graceful_shutdown', methods=['GET'])
 def graceful_shutdown_request():
     '''
     This is for the shutdown.
     '''
-    # Before shutdown , call ThreadPool stop
-    current_app.stop()
+    timeout = request.args.get('timeout', float(os.environ.get('TP_SHUTDOWN_TIMEOUT', 10)), type=float)
+
+    persisted_jobs = drain_and_persist(timeout)
+
+    # In pre-fork mode, the master gets the other processes to drain too.
+    # They persist their own jobs, persisted_jobs only counts this process's.
+    if 'TP_MASTER_PID' in os.environ:
+        os.kill(int(os.environ['TP_MASTER_PID']), signal.SIGUSR1)
 
     # Return JSON response 
-    return jsonify({"status": "success"}), 200
+    return jsonify({"status": "success", "persisted_jobs": persisted_jobs}), 200
+
+
+def drain_and_persist(timeout):
+    '''
+    Stop taking jobs and drain the queue for up to timeout seconds, then
+    save the jobs still queued for the next start.
+
+    Returns the number of jobs saved.
+    '''
+    tasks_runner = webserver.tasks_runner
+    queued_tasks = tasks_runner.shutdown(timeout)
+    webserver.job_log.save(tasks_runner.jobs.last_id(),
+                           [{"job_id": task_id, "deadline": deadline, "task": serialize_task(task)}
+                            for task, task_id, deadline in queued_tasks])
+    return len(queued_tasks)
 
 
 # You can check localhost in your browser to see what this displays
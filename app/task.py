@@ -1,11 +1,17 @@
-from app import webserver
-
 class Task:
     '''
     Class of tasks.
     '''
-    def __init__(self, data_frame):
-        self.data_frame = data_frame
+    def __init__(self, data_ingestor):
+        self.data_ingestor = data_ingestor
+
+    @property
+    def data_frame(self):
+        '''
+        The data of the dataset, read when the task runs rather than when it
+        is queued.
+        '''
+        return self.data_ingestor.data
 
     def execute(self):
         '''
@@ -13,14 +19,14 @@ class Task:
         '''
         raise NotImplementedError("Method 'execute' must be implemented in subclasses")
 
-class CalculateMeanTask:
+class CalculateMeanTask(Task):
     '''
     Gets the mean from a state.
     '''
-    def __init__(self, question, state, data_frame):
+    def __init__(self, question, state, data_ingestor):
         self.question = question
         self.state = state
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -39,8 +45,7 @@ class CalculateMeanTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         if self.state is None:
@@ -56,13 +61,13 @@ class CalculateMeanTask:
                                (self.data_frame['LocationDesc'] == self.state)]
 
 
-class CalculateStatesMeanTask:
+class CalculateStatesMeanTask(Task):
     '''
     This gets the average for all the states.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -81,8 +86,7 @@ class CalculateStatesMeanTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -92,18 +96,18 @@ class CalculateStatesMeanTask:
         Calculate mean values for all states based on the question.
         '''
         relevant_data = self.data_frame[self.data_frame['Question'] == self.question]
-        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc')}
+        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc', observed=True)}
         return state_means
 
 
 
-class CalculateBest5Task:
+class CalculateBest5Task(Task):
     '''
     This gets top 5 of the values.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -123,8 +127,7 @@ class CalculateBest5Task:
         '''
         Validate input
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -134,7 +137,7 @@ class CalculateBest5Task:
         Calculate mean values for all states based on the question.
         '''
         relevant_data = self.data_frame[self.data_frame['Question'] == self.question]
-        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc')}
+        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc', observed=True)}
         return state_means
 
 
@@ -142,7 +145,7 @@ class CalculateBest5Task:
         '''
         Sort states based on mean values.
         '''
-        if self.question in webserver.data_ingestor.questions_best_is_min:
+        if self.question in self.data_ingestor.min_questions:
             sorted_results = sorted(state_means.items(), key=lambda x: x[1])
         else:
             sorted_results = sorted(state_means.items(), key=lambda x: x[1], reverse=True)
@@ -155,16 +158,16 @@ class CalculateBest5Task:
         best_5 = dict(sorted_results[:5])
         return best_5
 
-class CalculateWorst5Task:
+class CalculateWorst5Task(Task):
     '''
     This gets worst 5 of the values.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         '''
         Initialize CalculateWorst5Task.
         '''
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -184,8 +187,7 @@ class CalculateWorst5Task:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -195,7 +197,7 @@ class CalculateWorst5Task:
         Calculate mean values for all states based on the question.
         '''
         relevant_data = self.data_frame[self.data_frame['Question'] == self.question]
-        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc')}
+        state_means = {state: state_data['Data_Value'].mean() for state, state_data in relevant_data.groupby('LocationDesc', observed=True)}
         return state_means
 
 
@@ -203,7 +205,7 @@ class CalculateWorst5Task:
         '''
         Sort based on mean values.
         '''
-        if self.question in webserver.data_ingestor.questions_best_is_max:
+        if self.question in self.data_ingestor.max_questions:
             sorted_results = sorted(state_means.items(), key=lambda x: x[1])
         else:
             sorted_results = sorted(state_means.items(), key=lambda x: x[1], reverse=True)
@@ -217,16 +219,16 @@ class CalculateWorst5Task:
         return worst_5
 
 
-class CalculateGlobalMeanTask:
+class CalculateGlobalMeanTask(Task):
     '''
     This gets the value of the global mean.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         '''
         Initialize CalculateGlobalMeanTask.
         '''
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -243,8 +245,7 @@ class CalculateGlobalMeanTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -258,16 +259,16 @@ class CalculateGlobalMeanTask:
         return global_mean
 
 
-class CalculateDiffFromMeanTask:
+class CalculateDiffFromMeanTask(Task):
     '''
     This gets the difference calculated by mean.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         '''
         Initialize CalculateDiffFromMeanTask.
         '''
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -287,8 +288,7 @@ class CalculateDiffFromMeanTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -318,17 +318,17 @@ class CalculateDiffFromMeanTask:
         sorted_diff_from_mean = sorted({state: global_mean - mean for state, mean in state_means.items()}.items(), key=lambda x: x[1], reverse=True)
         return {state: mean for state, mean in sorted_diff_from_mean}
 
-class CalculateStateDiffFromMeanTask:
+class CalculateStateDiffFromMeanTask(Task):
     '''
     This gets the difference of means.
     '''
-    def __init__(self, question, state, data_frame):
+    def __init__(self, question, state, data_ingestor):
         '''
         Initialize CalculateStateDiffFromMeanTask.
         '''
         self.question = question
         self.state = state
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -347,8 +347,7 @@ class CalculateStateDiffFromMeanTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -370,16 +369,16 @@ class CalculateStateDiffFromMeanTask:
         return state_mean, global_mean
 
 
-class CalculateMeanByCategoryTask:
+class CalculateMeanByCategoryTask(Task):
     '''
     Gets the mean value from a category.
     '''
-    def __init__(self, question, data_frame):
+    def __init__(self, question, data_ingestor):
         '''
         Initialize CalculateMeanByCategoryTask.
         '''
         self.question = question
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -398,8 +397,7 @@ class CalculateMeanByCategoryTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -408,7 +406,7 @@ class CalculateMeanByCategoryTask:
         '''
         Calculate the mean value for each category from states.
         '''
-        return self.data_frame[self.data_frame['Question'] == self.question].groupby(['LocationDesc', 'StratificationCategory1', 'Stratification1'])['Data_Value'].mean()
+        return self.data_frame[self.data_frame['Question'] == self.question].groupby(['LocationDesc', 'StratificationCategory1', 'Stratification1'], observed=True)['Data_Value'].mean()
 
     def format_results(self, mean_by_category):
         '''
@@ -417,17 +415,29 @@ class CalculateMeanByCategoryTask:
         formatted_results = {f"('{state}', '{category}', '{segment}')": mean_value for (state, category, segment), mean_value in mean_by_category.items()}
         return formatted_results
 
-class CalculateStateMeanByCategoryTask:
+    def iter_rows(self):
+        '''
+        Yield the formatted results one (key, mean) row at a time.
+
+        The means are all computed before the first row: only formatting
+        and writing the rows is streamed. Grouping one state at a time was
+        slower overall without getting the first row out sooner, as
+        selecting the rows of the question is what takes the time.
+        '''
+        for (state, category, segment), mean_value in self.calculate_mean_by_category().items():
+            yield f"('{state}', '{category}', '{segment}')", mean_value
+
+class CalculateStateMeanByCategoryTask(Task):
     '''
     This gets a states mean from a category.
     '''
-    def __init__(self, question, state, data_frame):
+    def __init__(self, question, state, data_ingestor):
         '''
         Initialize CalculateStateMeanByCategoryTask.
         '''
         self.question = question
         self.state = state
-        self.data_frame = data_frame
+        self.data_ingestor = data_ingestor
 
     def execute(self):
         '''
@@ -446,8 +456,7 @@ class CalculateStateMeanByCategoryTask:
         '''
         Validate the input parameters.
         '''
-        if self.question not in webserver.data_ingestor.questions_best_is_min and \
-           self.question not in webserver.data_ingestor.questions_best_is_max:
+        if self.question not in self.data_ingestor.valid_questions:
             return {"status": "error", "message": "Invalid question"}
 
         return None
@@ -457,7 +466,7 @@ class CalculateStateMeanByCategoryTask:
         Calculate the mean value by category for state and question.
         '''
         relevant_data = self.data_frame[(self.data_frame['Question'] == self.question) & (self.data_frame['LocationDesc'] == self.state)]
-        mean_by_category = relevant_data.groupby(['StratificationCategory1', 'Stratification1'])['Data_Value'].mean()
+        mean_by_category = relevant_data.groupby(['StratificationCategory1', 'Stratification1'], observed=True)['Data_Value'].mean()
         return mean_by_category
 
     def format_results(self, mean_by_category):
@@ -467,3 +476,142 @@ class CalculateStateMeanByCategoryTask:
         formatted_results = {f"('{category}', '{segment}')": mean_value for (category, segment), mean_value in mean_by_category.items()}
         return formatted_results
 
+
+
+class CalculateStateQuantileTask(Task):
+    '''
+    Gets a quantile of the values from a state.
+    '''
+    def __init__(self, question, state, quantile, data_ingestor):
+        '''
+        Initialize CalculateStateQuantileTask.
+        '''
+        self.question = question
+        self.state = state
+        self.quantile = quantile
+        self.data_ingestor = data_ingestor
+
+    def execute(self):
+        '''
+        Execute func for CalculateStateQuantileTask.
+        '''
+        error_response = self.validate_input()
+        if error_response:
+            return error_response, 400
+
+        sketch = self.data_ingestor.state_sketches.get(self.question, {}).get(self.state)
+
+        return {self.state: sketch.quantile(self.quantile) if sketch is not None else None}
+
+    def validate_input(self):
+        '''
+        Validate the input parameters.
+        '''
+        if self.question not in self.data_ingestor.valid_questions:
+            return {"status": "error", "message": "Invalid question"}
+
+        if self.state is None:
+            return {"status": "error", "message": "State not specified"}
+
+        return validate_quantile(self.quantile)
+
+
+class CalculateStatesQuantileTask(Task):
+    '''
+    Gets a quantile of the values for all the states.
+    '''
+    def __init__(self, question, quantile, data_ingestor):
+        '''
+        Initialize CalculateStatesQuantileTask.
+        '''
+        self.question = question
+        self.quantile = quantile
+        self.data_ingestor = data_ingestor
+
+    def execute(self):
+        '''
+        Execute func for CalculateStatesQuantileTask.
+        '''
+        error_response = self.validate_input()
+        if error_response:
+            return error_response, 400
+
+        state_quantiles = {state: sketch.quantile(self.quantile)
+                           for state, sketch in self.data_ingestor.state_sketches.get(self.question, {}).items()}
+
+        return {state: value for state, value in sorted(state_quantiles.items(), key=lambda x: x[1])}
+
+    def validate_input(self):
+        '''
+        Validate the input parameters.
+        '''
+        if self.question not in self.data_ingestor.valid_questions:
+            return {"status": "error", "message": "Invalid question"}
+
+        return validate_quantile(self.quantile)
+
+
+class CalculateGlobalQuantileTask(Task):
+    '''
+    Gets a quantile of the values over all the states.
+    '''
+    def __init__(self, question, quantile, data_ingestor):
+        '''
+        Initialize CalculateGlobalQuantileTask.
+        '''
+        self.question = question
+        self.quantile = quantile
+        self.data_ingestor = data_ingestor
+
+    def execute(self):
+        '''
+        Execute func for CalculateGlobalQuantileTask.
+        '''
+        error_response = self.validate_input()
+        if error_response:
+            return error_response, 400
+
+        sketch = self.data_ingestor.question_sketches.get(self.question)
+
+        return {"global_quantile": sketch.quantile(self.quantile) if sketch is not None else None}
+
+    def validate_input(self):
+        '''
+        Validate the input parameters.
+        '''
+        if self.question not in self.data_ingestor.valid_questions:
+            return {"status": "error", "message": "Invalid question"}
+
+        return validate_quantile(self.quantile)
+
+
+def validate_quantile(quantile):
+    '''
+    Check that the requested quantile is a number between 0 and 1.
+    '''
+    if isinstance(quantile, bool) or not isinstance(quantile, (int, float)) or not 0 <= quantile <= 1:
+        return {"status": "error", "message": "Quantile must be a number between 0 and 1"}
+
+    return None
+
+
+def serialize_task(task):
+    '''
+    Describe a task as a JSON-serializable dict, leaving out its data source.
+    '''
+    params = {name: value for name, value in vars(task).items() if name != 'data_ingestor'}
+    return {"type": type(task).__name__, "dataset": task.data_ingestor.name, "params": params}
+
+
+def restore_task(record, datasets):
+    '''
+    Rebuild a task described by serialize_task, on its dataset from datasets.
+    The dataset is only loaded when the task runs.
+    Returns None if the dataset is no longer registered.
+    '''
+    task_class = globals()[record["type"]]
+    data_ingestor = datasets.handle(record.get("dataset"))
+    if data_ingestor is None:
+        return None
+
+    return task_class(**record["params"], data_ingestor=data_ingestor)
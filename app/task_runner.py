@@ -1,26 +1,58 @@
+import itertools
 import json
-from queue import Queue
-from threading import Thread, Event
+from collections import deque
+from pathlib import Path
+from threading import Thread, Event, Lock, Semaphore
 import os
+import time
 import multiprocessing
-from queue import Empty
+from app.job_table import JobTable
+
+# Directory where the results of finished jobs are saved
+RESULTS_DIR = Path(os.environ.get('TP_RESULTS_DIR', 'results'))
 
 class ThreadPool:
     """
     This class implements a thread pool.
+
+    The pool grows from TP_MIN_THREADS up to TP_NUM_OF_THREADS workers while
+    tasks pile up or wait longer than TP_TARGET_LATENCY seconds, and workers
+    above the minimum exit after TP_IDLE_TIMEOUT seconds without work.
+    Growth is checked when a task is queued and, for tasks stuck behind busy
+    workers, every TP_TARGET_LATENCY seconds.
     """
 
-    def __init__(self):
+    def __init__(self, jobs=None):
         """
         Initialize the ThreadPool instance.
+
+        Args:
+            jobs (JobTable): Where job statuses and results are kept, a new
+                table local to this process if not given.
         """
-        self.dictionary = {}
-        self.id_counter = 0  # Counter task IDs
+        self.jobs = jobs if jobs is not None else JobTable()
+        self.lock = Lock()  # Guards the queue counters and the pool size
         self.num_threads = self.get_thread_count()  # Get the number of threads allowed
+        self.min_threads = max(1, min(int(os.environ.get('TP_MIN_THREADS', 1)), self.num_threads))
+        self.idle_timeout = float(os.environ.get('TP_IDLE_TIMEOUT', 5))
+        self.target_latency = float(os.environ.get('TP_TARGET_LATENCY', 0.05))
 
-        # Initialize a task queue and threads 
-        self.task_queue = Queue()
-        self.threads = [TaskRunner(self.task_queue, self.dictionary) for _ in range(self.num_threads)]
+        # One task deque per worker slot. Workers take tasks from their own
+        # deque and steal from the others when it is empty. Taking a task
+        # still goes through the pool lock to keep the counters below.
+        self.queues = [deque() for _ in range(self.num_threads)]
+        self.available = Semaphore(0)  # One permit per queued task
+        self.pending = 0  # Number of queued tasks
+        self.idle = 0  # Number of workers waiting for a task
+        self.wait_time = 0.0  # Moving average of the time tasks spend queued
+        self.next_slot = 0
+        self.running = False
+        self.stopped = Event()  # Stops the thread watching for stuck tasks
+        self.backlog = Event()  # Set while tasks are queued, for that thread
+        self.accepting = True  # Cleared when the pool drains for shutdown
+
+        self.threads = {}  # slot -> TaskRunner
+        self.slots = []  # Slots of the live workers, for round-robin dispatch
 
     def get_thread_count(self):
         """
@@ -28,47 +60,429 @@ class ThreadPool:
         """
         return int(os.environ.get('TP_NUM_OF_THREADS', multiprocessing.cpu_count()))
 
-    def add_task(self, task):
+    def add_task(self, task, timeout=None):
         """
         Add task to the task queue.
+
+        If a timeout (in seconds) is given, the task is skipped and marked
+        "expired" when no worker picked it up before the deadline.
+        Returns the task id, or None if the pool is shutting down.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+
+        # Checked again under the lock below, this only saves creating a job
+        if not self.accepting:
+            return None
+
+        task_id = self.jobs.add({"status": "queued", "result": None, "deadline": deadline})
+
+        # Check again with the task queued under the same lock, so a task is
+        # either in the queues shutdown() persists or not accepted at all
+        with self.lock:
+            accepting = self.accepting
+            if accepting:
+                slot = self.enqueue()
+                self.queues[slot].append((task, task_id, time.time()))
+                self.available.release()
+
+        if not accepting:
+            self.jobs.delete(task_id)
+            return None
+
+        return task_id
+
+    def add_result(self, result):
         """
-        self.id_counter += 1
-        task_id = self.id_counter
-        self.task_queue.put((task, task_id))
+        Register a job whose result is already known, without queuing it.
+
+        Returns the task id, or None if the pool is shutting down.
+        """
+        with self.lock:
+            if not self.accepting:
+                return None
+
+        task_id = self.jobs.add({"status": "done", "result": result})
+
+        # Saved like the results of run tasks, so it survives a restart too
+        self.save_result(task_id, result)
         return task_id
 
+    def save_result(self, job_id, result):
+        """
+        Save result to JSON.
+        """
+        # Create the directory if it doesn't exist
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+        # Define the path to the JSON file
+        file_path = RESULTS_DIR / f"{job_id}.json"
+
+        # Write the results to the JSON file
+        with file_path.open(mode='w', encoding='utf-8') as file:
+            json.dump(result, file)
+
+    def save_status(self, job_id, status):
+        """
+        Save the final status of a job that ended without a result.
+
+        Written to a temporary file then renamed, so readers never see it empty.
+        """
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = RESULTS_DIR / f"{job_id}.status.tmp"
+        tmp_path.write_text(status, encoding='utf-8')
+        tmp_path.replace(RESULTS_DIR / f"{job_id}.status")
+
+    def enqueue(self):
+        """
+        Count a queued task and pick the slot whose deque receives it.
+        Must be called with the lock held.
+        """
+        self.pending += 1
+        if not self.backlog.is_set():
+            self.backlog.set()
+
+        if self.slots:
+            self.next_slot = (self.next_slot + 1) % len(self.slots)
+            slot = self.slots[self.next_slot]
+        else:
+            slot = 0
+
+        self.grow()
+        return slot
+
+    def restore(self, id_counter, tasks):
+        """
+        Queue the tasks persisted by a previous run under their old ids.
+
+        Tasks whose result was saved already, by a run that stopped before
+        the log was discarded, are not queued again.
+
+        Args:
+            id_counter (int): Last task id given by the previous run.
+            tasks (list): (task, task_id, deadline) tuples.
+        """
+        now = time.time()
+        # A run that did not shut down gracefully saved no id counter, the
+        # saved results tell which ids it gave
+        self.jobs.reserve_ids(max(id_counter, self.last_saved_id()))
+        tasks = [(task, task_id, deadline) for task, task_id, deadline in tasks
+                 if self.load_result(task_id) is None]
+        for task, task_id, deadline in tasks:
+            self.jobs.set(task_id, {"status": "queued", "result": None, "deadline": deadline})
+
+        with self.lock:
+            for task, task_id, _ in tasks:
+                slot = self.enqueue()
+                self.queues[slot].append((task, task_id, now))
+                self.available.release()
+
+    def last_saved_id(self):
+        """
+        Get the highest id of the jobs with a saved result or status, 0 if none.
+        """
+        if not RESULTS_DIR.is_dir():
+            return 0
+
+        job_ids = (path.name.split(".", 1)[0] for path in RESULTS_DIR.iterdir())
+        return max((int(job_id) for job_id in job_ids if job_id.isdigit()), default=0)
+
+    def cancel_task(self, task_id):
+        """
+        Cancel a queued task.
+
+        The task stays in the queue and is dropped by the worker that takes
+        it. Returns the status of the task after the call, or None if the
+        task does not exist.
+        """
+        if self.jobs.transition(task_id, "queued", {"status": "cancelled", "result": None}):
+            # Kept so the job is still known as cancelled after a restart
+            self.save_status(task_id, "cancelled")
+            return "cancelled"
+
+        task_info = self.jobs.get(task_id)
+        return task_info["status"] if task_info is not None else None
+
+    def grow(self):
+        """
+        Add a worker if the queued tasks outnumber the idle workers and
+        either exceed the pool size or wait longer than the target latency.
+        Must be called with the lock held.
+        """
+        if not self.running or len(self.threads) >= self.num_threads:
+            return
+
+        if self.pending > self.idle and \
+           (self.pending > len(self.threads) or self.wait_time > self.target_latency):
+            self.spawn_worker()
+
+    def watch(self):
+        """
+        Add a worker whenever queued tasks wait longer than the target
+        latency with no idle worker to take them, e.g. behind long tasks,
+        as no new task may come to trigger grow(). Sleeps while the queue
+        is empty.
+        """
+        while self.backlog.wait() and not self.stopped.wait(self.target_latency):
+            with self.lock:
+                if not self.running or len(self.threads) >= self.num_threads or self.pending <= self.idle:
+                    continue
+
+                oldest = self.oldest_queued_at()
+                if oldest is not None and time.time() - oldest > self.target_latency:
+                    self.spawn_worker()
+
+    def oldest_queued_at(self):
+        """
+        Get the time the oldest queued task was queued at, or None.
+        """
+        queued_at = []
+        for queue in self.queues:
+            try:
+                queued_at.append(queue[0][2])
+            except IndexError:
+                # Empty, or emptied by a worker in the meantime
+                continue
+        return min(queued_at, default=None)
+
+    def spawn_worker(self):
+        """
+        Start a worker on the first free slot. Must be called with the lock held.
+        """
+        slot = next(index for index in range(self.num_threads) if index not in self.threads)
+        worker = TaskRunner(self, slot)
+        self.threads[slot] = worker
+        self.slots.append(slot)
+        worker.start()
+
+    def retire_worker(self, worker):
+        """
+        Remove an idle worker from the pool. Must be called with the lock held.
+
+        Tasks left in its deque are stolen by the remaining workers.
+        """
+        del self.threads[worker.slot]
+        self.slots.remove(worker.slot)
+        worker.stop()
+
+    def next_task(self, worker):
+        """
+        Wait for a task and take it, or return None if the worker should
+        check whether it has to stop.
+
+        Workers above the minimum pool size give up after the idle timeout
+        and retire; the others block without waking up periodically.
+        """
+        # Under load a task is usually queued already, and taking it only
+        # goes through the lock once
+        acquired = self.available.acquire(blocking=False)
+        waited = not acquired
+        if waited:
+            with self.lock:
+                self.idle += 1
+                timeout = self.idle_timeout if len(self.threads) > self.min_threads else None
+
+            acquired = self.available.acquire(timeout=timeout)
+
+        with self.lock:
+            if waited:
+                self.idle -= 1
+            if not acquired:
+                if len(self.threads) > self.min_threads:
+                    self.retire_worker(worker)
+                return None
+
+            if worker.graceful_shutdown.is_set():
+                return None
+
+            self.pending -= 1
+            if self.pending == 0:
+                self.backlog.clear()
+
+        task, task_id, queued_at = self.take_task(worker.slot)
+
+        # A lost update only skews the average, no need for the lock here
+        self.wait_time = 0.8 * self.wait_time + 0.2 * (time.time() - queued_at)
+        return task, task_id
+
+    def take_task(self, slot):
+        """
+        Pop the oldest task of the worker's deque, or steal the oldest task
+        of another deque. The caller holds a permit, so a task exists.
+        """
+        while True:
+            for offset in range(self.num_threads):
+                try:
+                    return self.queues[(slot + offset) % self.num_threads].popleft()
+                except IndexError:
+                    continue
+
     def start(self):
         """
-        Start every thread from the pool.
+        Start the minimum number of threads of the pool.
+        """
+        with self.lock:
+            self.running = True
+            while len(self.threads) < self.min_threads:
+                self.spawn_worker()
+
+        Thread(target=self.watch, daemon=True).start()
+
+    def shutdown(self, timeout):
+        """
+        Stop accepting tasks, let the workers drain the queue for up to
+        timeout seconds, then stop them.
+
+        Returns the (task, task_id, deadline) tuples still queued. Once the
+        pool is shut down, further calls return them right away.
+        """
+        deadline = time.time() + timeout
+        with self.lock:
+            shut_down = not self.accepting
+            self.accepting = False
+            workers = list(self.threads.values())
+
+        if shut_down:
+            return self.queued_tasks()
+
+        # Every worker idle with nothing pending means the queue is drained
+        while time.time() < deadline:
+            with self.lock:
+                if self.pending == 0 and self.idle == len(self.threads):
+                    break
+            time.sleep(0.05)
+
+        self.stop()
+        for worker in workers:
+            worker.join(max(0, deadline - time.time()))
+
+        return self.queued_tasks()
+
+    def queued_tasks(self):
+        """
+        Get the (task, task_id, deadline) tuples of the tasks still queued.
+        """
+        tasks = []
+        with self.lock:
+            queued = [(task, task_id) for queue in self.queues for task, task_id, _ in list(queue)]
+
+        for task, task_id in queued:
+            task_info = self.jobs.get(task_id)
+            if task_info["status"] == "queued":
+                tasks.append((task, task_id, task_info["deadline"]))
+
+        return sorted(tasks, key=lambda x: x[1])
+
+    def load_result(self, job_id):
+        """
+        Load the saved result of a job finished by a previous run.
+
+        Returns the job info, or None if no result was saved.
         """
-        num_threads = len(self.threads)
-        index = 0
-        while index < num_threads:
-            self.threads[index].start()
-            index += 1
+        status_path = RESULTS_DIR / f"{job_id}.status"
+        if status_path.is_file():
+            return {"status": status_path.read_text(encoding='utf-8'), "result": None}
+
+        if (RESULTS_DIR / f"{job_id}.ndjson").is_file():
+            return {"status": "done", "result": None, "streamed": True}
+
+        file_path = RESULTS_DIR / f"{job_id}.json"
+        if not file_path.is_file():
+            return None
+
+        with file_path.open(mode='r', encoding='utf-8') as file:
+            return {"status": "done", "result": json.load(file)}
+
+    def stream_result(self, job_id):
+        """
+        Yield the NDJSON lines of a streamed result, following the file
+        while its task is still writing it.
+        """
+        try:
+            # Written under a temporary name until the task is done
+            file = (RESULTS_DIR / f"{job_id}.ndjson.part").open(mode='r', encoding='utf-8')
+        except FileNotFoundError:
+            file = (RESULTS_DIR / f"{job_id}.ndjson").open(mode='r', encoding='utf-8')
+
+        with file:
+            partial = ""
+            while True:
+                line = file.readline()
+                if line.endswith("\n"):
+                    yield partial + line
+                    partial = ""
+                    continue
+
+                partial += line
+                task_info = self.jobs.get(job_id)
+                if task_info is None or task_info["status"] != "running":
+                    # The task is done, read what it wrote since the last check
+                    rest = partial + file.read()
+                    if rest:
+                        yield rest
+                    return
+
+                time.sleep(0.01)
+
+    def result_page(self, job_id, task_info, cursor, limit):
+        """
+        Get up to limit (key, value) rows of a finished result, from cursor.
+
+        The cursor is the byte offset of the next row for streamed results
+        and the row index for the others. Returns the rows and the cursor
+        of the next page, None after the last one. Raises ValueError if the
+        cursor is not the start of a row.
+        """
+        rows = []
+        if task_info.get("streamed"):
+            with (RESULTS_DIR / f"{job_id}.ndjson").open(mode='rb') as file:
+                # Rows start at the beginning of the file or right after a newline
+                if cursor > 0:
+                    file.seek(cursor - 1)
+                    if file.read(1) != b"\n":
+                        raise ValueError("Invalid cursor")
+                while len(rows) < limit:
+                    line = file.readline()
+                    if not line:
+                        return rows, None
+                    row = json.loads(line)
+                    rows.append((row["key"], row["value"]))
+                next_cursor = file.tell()
+                return rows, next_cursor if file.readline() else None
+
+        items = task_info["result"].items()
+        rows = list(itertools.islice(items, cursor, cursor + limit))
+        return rows, cursor + limit if cursor + limit < len(items) else None
 
     def stop(self):
         """
         Get every thread to stop.
         """
-        num_threads = len(self.threads)
-        index = 0
-        while index < num_threads:
-            self.threads[index].stop()
-            index += 1
+        with self.lock:
+            self.running = False
+            workers = list(self.threads.values())
+        self.stopped.set()
+        self.backlog.set()
+
+        for worker in workers:
+            worker.stop()
+
+        # Wake up the workers blocked waiting for a task
+        for _ in workers:
+            self.available.release()
 
 class TaskRunner(Thread):
     """
     Class that implements the functionality of a thread.
     """
-    def __init__(self, task_queue, dictionary):
+    def __init__(self, pool, slot):
         """
         init function for Task_Runner.
         """
         Thread.__init__(self)
-        self.task_queue = task_queue
+        self.pool = pool
+        self.slot = slot
         self.graceful_shutdown = Event()
-        self.dictionary = dictionary
+        self.jobs = pool.jobs
 
     def run(self):
         """
@@ -76,16 +490,15 @@ class TaskRunner(Thread):
         """
         while not self.graceful_shutdown.is_set():
             try:
-                # Wait for a task from the queue with a timeout
-                task, task_id = self.task_queue.get(timeout=1)
+                # Wait for a task from the pool
+                next_task = self.pool.next_task(self)
+                if next_task is None:
+                    continue
 
                 # Execute the task and save the result
+                task, task_id = next_task
                 self.execute_task(task, task_id)
 
-            except Empty:
-                # Empty queue, continue 
-                continue
-
             except Exception as e:
                 # Handle specific exceptions or log them as needed
                 print(f"Error occurred")
@@ -96,11 +509,32 @@ class TaskRunner(Thread):
         """
         Execute a task and save the result.
         """
-        # Update status to "running" initially
-        self.update_status(id, "running", None)
+        # Update status to "running" initially, unless the job was
+        # cancelled or its deadline passed while it was queued
+        if not self.claim_task(id):
+            return
+
+        # Tasks producing rows incrementally write them out as they come
+        if hasattr(task, "iter_rows") and task.validate_input() is None:
+            try:
+                row_count = self.stream_rows(id, task.iter_rows())
+            except Exception:
+                # Let readers following the file stop
+                self.jobs.set(id, {"status": "error", "result": None})
+                self.pool.save_status(id, "error")
+                raise
+
+            self.jobs.set(id, {"status": "done", "result": None, "streamed": True, "rows": row_count})
+            return
 
         # Execute the task and get the result
-        value = task.execute()
+        try:
+            value = task.execute()
+        except Exception:
+            # A failed task must not stay "running" forever
+            self.jobs.set(id, {"status": "error", "result": None})
+            self.pool.save_status(id, "error")
+            raise
 
         # Update status to "done" and save the result
         self.update_status(id, "done", value)
@@ -108,28 +542,67 @@ class TaskRunner(Thread):
         # Process the data or perform necessary operations
         self.save_result(id, value)
 
+    def claim_task(self, job_id):
+        """
+        Mark a queued task as running. Returns False if it must be skipped.
+        """
+        task_info = self.jobs.get(job_id)
+        if task_info["status"] != "queued":
+            return False
+
+        deadline = task_info["deadline"]
+        if deadline is not None and time.time() > deadline:
+            if self.jobs.transition(job_id, "queued", {"status": "expired", "result": None}):
+                self.pool.save_status(job_id, "expired")
+            return False
+
+        # Fails if the job was cancelled in the meantime
+        return self.jobs.transition(job_id, "queued", {"status": "running", "result": None})
+
     def update_status(self, job_id, status, result):
         """
-        Update the status and result in the dictionary.
+        Update the status and result in the job table.
         """
-        self.dictionary[job_id] = {"status": status, "result": result}
+        self.jobs.set(job_id, {"status": status, "result": result})
 
-    def save_result(self, job_id, result):
+    def stream_rows(self, job_id, rows):
         """
-        Save result to JSON.
+        Save (key, value) rows to NDJSON as the task yields them.
+
+        Readers can follow the file as soon as the job is marked streamed.
+        The rows go to a temporary file renamed once they are all written,
+        so a file under the final name is always complete, even after a
+        crash. Returns the number of rows written.
         """
-        # Define the directory where the results will be saved
-        results_dir = Path("results")
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        file_path = RESULTS_DIR / f"{job_id}.ndjson.part"
 
-        # Create the directory if it doesn't exist
-        results_dir.mkdir(parents=True, exist_ok=True)
+        row_count = 0
+        last_flush = time.monotonic()
+        try:
+            with file_path.open(mode='w', encoding='utf-8') as file:
+                self.jobs.set(job_id, {"status": "running", "result": None, "streamed": True})
+                for key, value in rows:
+                    file.write(json.dumps({"key": key, "value": value}) + "\n")
+                    row_count += 1
 
-        # Define the path to the JSON file
-        file_path = results_dir / f"{job_id}.json"
+                    # Flush often enough for readers following the file
+                    if time.monotonic() - last_flush > 0.05:
+                        file.flush()
+                        last_flush = time.monotonic()
+        except Exception:
+            file_path.unlink(missing_ok=True)
+            raise
 
-        # Write the results to the JSON file
-        with file_path.open(mode='w', encoding='utf-8') as file:
-            json.dump(result, file)
+        # Readers following the file keep reading it under its new name
+        file_path.replace(RESULTS_DIR / f"{job_id}.ndjson")
+        return row_count
+
+    def save_result(self, job_id, result):
+        """
+        Save result to JSON.
+        """
+        self.pool.save_result(job_id, result)
     def stop(self):
         """
         The thread stops.
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import time
+from threading import Thread
+from app.task import (CalculateStatesMeanTask, CalculateMeanTask, CalculateBest5Task, CalculateWorst5Task,
+                      CalculateGlobalMeanTask, CalculateDiffFromMeanTask, CalculateStateDiffFromMeanTask,
+                      CalculateMeanByCategoryTask, CalculateStateMeanByCategoryTask)
+
+# Endpoint name -> (task class, whether the task takes a state)
+ENDPOINT_TASKS = {
+    'states_mean': (CalculateStatesMeanTask, False),
+    'state_mean': (CalculateMeanTask, True),
+    'best5': (CalculateBest5Task, False),
+    'worst5': (CalculateWorst5Task, False),
+    'global_mean': (CalculateGlobalMeanTask, False),
+    'diff_from_mean': (CalculateDiffFromMeanTask, False),
+    'state_diff_from_mean': (CalculateStateDiffFromMeanTask, True),
+    'mean_by_category': (CalculateMeanByCategoryTask, False),
+    'state_mean_by_category': (CalculateStateMeanByCategoryTask, True),
+}
+
+class MaterializedViews:
+    """
+    Class holding the precomputed result of every endpoint for every valid
+    question and state, tied to the version of the dataset it was built from.
+    """
+    def __init__(self, datasets, dataset=None):
+        """
+        Initialize the MaterializedViews instance. Nothing is built yet.
+
+        Args:
+            datasets (DatasetRegistry): The registered datasets.
+            dataset (str): The dataset the views are computed on, the default one if None.
+        """
+        self.datasets = datasets
+        self.dataset = dataset if dataset is not None else datasets.default
+        # (dataset version, views) swapped as one object so readers never mix
+        # views with another version; views map (task type, question, state)
+        # to (etag, result)
+        self.snapshot = (None, {})
+
+    def build(self):
+        """
+        Compute every view for the current dataset version and swap them in.
+        """
+        data_ingestor = self.datasets.get(self.dataset)
+        version = data_ingestor.version
+        data = data_ingestor.data
+        questions = data_ingestor.questions_best_is_min + data_ingestor.questions_best_is_max
+
+        views = {}
+        for question in questions:
+            states = data.loc[data['Question'] == question, 'LocationDesc'].unique()
+            for task_class, takes_state in ENDPOINT_TASKS.values():
+                if takes_state:
+                    for state in states:
+                        task = task_class(question, state, data_ingestor)
+                        views[(task_class.__name__, question, state)] = self.make_view(version, task.execute())
+                else:
+                    task = task_class(question, data_ingestor)
+                    views[(task_class.__name__, question, None)] = self.make_view(version, task.execute())
+
+        self.snapshot = (version, views)
+
+    def make_view(self, version, result):
+        """
+        Pair a result with its strong ETag.
+        """
+        content = json.dumps(result, sort_keys=True)
+        etag = hashlib.sha1(f"{version}:{content}".encode()).hexdigest()
+        return etag, result
+
+    def get(self, endpoint, question, state=None, dataset=None):
+        """
+        Get the (etag, result) view of an endpoint, or None if it is not
+        materialized for the current dataset version.
+        """
+        dataset = dataset if dataset is not None else self.datasets.default
+        if endpoint not in ENDPOINT_TASKS or dataset != self.dataset:
+            return None
+
+        task_class, takes_state = ENDPOINT_TASKS[endpoint]
+        return self.lookup(task_class.__name__, question, state if takes_state else None)
+
+    def get_for_task(self, task):
+        """
+        Get the (etag, result) view matching a task, or None.
+        """
+        if task.data_ingestor.name != self.dataset:
+            return None
+
+        return self.lookup(type(task).__name__, getattr(task, 'question', None), getattr(task, 'state', None))
+
+    def lookup(self, task_type, question, state):
+        """
+        Look up a view, ignoring views built from another dataset version.
+        """
+        # Views of an evicted dataset are kept, they are valid again if it is
+        # reloaded unchanged
+        data_ingestor = self.datasets.peek(self.dataset, touch=False)
+        version, views = self.snapshot
+        if data_ingestor is None or version != data_ingestor.version:
+            return None
+
+        return views.get((task_type, question, state))
+
+    def start_refresher(self, interval):
+        """
+        Start a background thread rebuilding the views when the data changes.
+
+        Args:
+            interval (float): Seconds between two checks of the CSV file.
+        """
+        def refresh():
+            while True:
+                time.sleep(interval)
+                try:
+                    refreshed = self.datasets.refresh(self.dataset)
+                    # Only a loaded dataset can change under the views, and
+                    # the reload may have grown it past the budget and evicted it
+                    data_ingestor = self.datasets.peek(self.dataset, touch=False)
+                    if data_ingestor is None:
+                        continue
+                    if refreshed or self.snapshot[0] != data_ingestor.version:
+                        self.build()
+                except Exception:
+                    print("Error occurred while refreshing the views")
+
+        Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# The benchmarks import the app package, which builds the server and replays
+# the job log, and run jobs: keep them away from the log and the results of a
+# server run from the same directory
+state_dir = tempfile.mkdtemp()
+os.environ['TP_JOB_LOG'] = os.path.join(state_dir, 'job_log.jsonl')
+os.environ['TP_RESULTS_DIR'] = os.path.join(state_dir, 'results')
@@ -0,0 +1,157 @@
+"""
+Benchmark the adaptive work-stealing pool against a fixed pool of
+MAX_THREADS workers sharing one Queue polled with get(timeout=1), under bursty load,
+then measure the dispatch cost of both pools with tasks doing nothing.
+
+Run from the repository root (next to the dataset CSV):
+
+    python -m benchmarks.bursty_pool
+"""
+import os
+import statistics
+import time
+from queue import Queue, Empty
+
+from app import webserver
+from app.task_runner import ThreadPool, TaskRunner
+
+BURSTS = 5
+BURST_SIZE = 500
+IDLE_GAP = 3.0
+IDLE_TIMEOUT = 1.0  # Shorter than the gaps, so the adaptive pool shrinks in between
+TASK_SLEEP = 0.002
+MAX_THREADS = 8
+DISPATCH_TASKS = 20000
+
+
+class SleepTask:
+    '''
+    Task that blocks briefly, like a task releasing the GIL in pandas.
+    '''
+    def __init__(self, finished):
+        self.finished = finished
+        self.submitted = time.perf_counter()
+
+    def execute(self):
+        '''
+        Sleep and record the completion latency.
+        '''
+        time.sleep(TASK_SLEEP)
+        self.finished.append(time.perf_counter() - self.submitted)
+        return None
+
+
+class NoopTask:
+    '''
+    Task doing nothing, so only the dispatch is measured.
+    '''
+    def __init__(self, finished):
+        self.finished = finished
+
+    def execute(self):
+        self.finished.append(None)
+        return None
+
+
+class LegacyRunner(TaskRunner):
+    '''
+    The previous worker loop: poll the shared Queue with get(timeout=1).
+    '''
+    def run(self):
+        while not self.graceful_shutdown.is_set():
+            try:
+                task, task_id = self.pool.task_queue.get(timeout=1)
+            except Empty:
+                continue
+            self.execute_task(task, task_id)
+
+
+class FixedPool(ThreadPool):
+    '''
+    The previous pool: MAX_THREADS workers sharing one Queue.
+    '''
+    def __init__(self):
+        ThreadPool.__init__(self)
+        self.task_queue = Queue()
+
+    def add_task(self, task, timeout=None):
+        task_id = self.jobs.add({"status": "queued", "result": None, "deadline": None})
+        self.task_queue.put((task, task_id))
+        return task_id
+
+    def start(self):
+        self.workers = [LegacyRunner(self, slot) for slot in range(self.num_threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+
+
+def run_bursts(pool):
+    '''
+    Submit the bursts, returning task latencies, CPU time spent while idle
+    and the number of workers left at the end of every gap.
+    '''
+    finished = []
+    idle_cpu = 0.0
+    sizes = []
+    for _ in range(BURSTS):
+        expected = len(finished) + BURST_SIZE
+        for _ in range(BURST_SIZE):
+            pool.add_task(SleepTask(finished))
+        while len(finished) < expected:
+            time.sleep(0.001)
+
+        start = time.process_time()
+        time.sleep(IDLE_GAP)
+        idle_cpu += time.process_time() - start
+        sizes.append(len(getattr(pool, 'workers', None) or pool.threads))
+    return finished, idle_cpu, sizes
+
+
+def run_dispatch(pool):
+    '''
+    Submit tasks doing nothing, returning the number of tasks run per second.
+    '''
+    finished = []
+    start = time.perf_counter()
+    for _ in range(DISPATCH_TASKS):
+        pool.add_task(NoopTask(finished))
+    while len(finished) < DISPATCH_TASKS:
+        time.sleep(0.001)
+    return DISPATCH_TASKS / (time.perf_counter() - start)
+
+
+def report(name, latencies, idle_cpu, sizes):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{name}: p50 {p50 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms, "
+          f"idle CPU {idle_cpu * 1000:.1f}ms over {BURSTS * IDLE_GAP:.0f}s, "
+          f"workers after each gap {sizes}")
+
+
+def main():
+    webserver.tasks_runner.stop()
+    os.environ['TP_NUM_OF_THREADS'] = str(MAX_THREADS)
+    os.environ['TP_IDLE_TIMEOUT'] = str(IDLE_TIMEOUT)
+
+    fixed = FixedPool()
+    fixed.start()
+    report("fixed queue pool", *run_bursts(fixed))
+    print(f"fixed queue pool dispatch: {run_dispatch(fixed):.0f} tasks/s")
+    fixed.stop()
+
+    adaptive = ThreadPool()
+    adaptive.start()
+    report("adaptive pool", *run_bursts(adaptive))
+    print(f"adaptive pool dispatch: {run_dispatch(adaptive):.0f} tasks/s")
+    adaptive.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure how DataIngestor loading and every Calculate*Task scale with the
+number of rows, on synthetic datasets from benchmarks.generate_dataset.
+
+    python -m benchmarks.data_scaling --max-rows 10000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app import webserver
+from app.data_ingestor import DataIngestor
+from app.task import (CalculateStatesMeanTask, CalculateMeanTask, CalculateBest5Task, CalculateWorst5Task,
+                      CalculateGlobalMeanTask, CalculateDiffFromMeanTask, CalculateStateDiffFromMeanTask,
+                      CalculateMeanByCategoryTask, CalculateStateMeanByCategoryTask,
+                      CalculateStateQuantileTask, CalculateStatesQuantileTask, CalculateGlobalQuantileTask)
+from benchmarks.generate_dataset import generate, QUESTIONS
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+STATE = 'State 0'
+
+
+def make_tasks(data_ingestor):
+    '''
+    One task of each type, on the same question and state.
+    '''
+    question = QUESTIONS[0]
+    return [
+        CalculateStatesMeanTask(question, data_ingestor),
+        CalculateMeanTask(question, STATE, data_ingestor),
+        CalculateBest5Task(question, data_ingestor),
+        CalculateWorst5Task(question, data_ingestor),
+        CalculateGlobalMeanTask(question, data_ingestor),
+        CalculateDiffFromMeanTask(question, data_ingestor),
+        CalculateStateDiffFromMeanTask(question, STATE, data_ingestor),
+        CalculateMeanByCategoryTask(question, data_ingestor),
+        CalculateStateMeanByCategoryTask(question, STATE, data_ingestor),
+        CalculateStateQuantileTask(question, STATE, 0.5, data_ingestor),
+        CalculateStatesQuantileTask(question, 0.5, data_ingestor),
+        CalculateGlobalQuantileTask(question, 0.5, data_ingestor),
+    ]
+
+
+def measure(func):
+    '''
+    Run func twice: once timed, once under tracemalloc for its peak memory.
+    Returns (seconds, peak bytes, result of the timed run).
+    '''
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-rows', type=int, default=SIZES[-1])
+    parser.add_argument('--states', type=int, default=55)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}  {'step':<34} {'time (s)':>10} {'peak (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in [size for size in SIZES if size <= args.max_rows]:
+            csv_path = os.path.join(tmp_dir, f'synthetic_{rows}.csv')
+            questions_best_is_min, questions_best_is_max = generate(csv_path, rows, args.states)
+
+            elapsed, peak, data_ingestor = measure(lambda: DataIngestor(csv_path, 'synthetic',
+                                                                        questions_best_is_min,
+                                                                        questions_best_is_max))
+            print(f"{rows:>10}  {'DataIngestor':<34} {elapsed:>10.3f} {peak / 2**20:>10.1f}")
+
+            for task in make_tasks(data_ingestor):
+                elapsed, peak, _ = measure(task.execute)
+                print(f"{rows:>10}  {type(task).__name__:<34} {elapsed:>10.3f} {peak / 2**20:>10.1f}")
+
+            os.remove(csv_path)
+
+    webserver.tasks_runner.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Generate a synthetic CSV with the schema of the nutrition survey subset.
+
+    python -m benchmarks.generate_dataset --rows 1000000 --states 55 out.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+QUESTIONS = [
+    'Percent of adults aged 18 years and older who have an overweight classification',
+    'Percent of adults aged 18 years and older who have obesity',
+    'Percent of adults who engage in no leisure-time physical activity',
+    'Percent of adults who report consuming fruit less than one time daily',
+    'Percent of adults who report consuming vegetables less than one time daily',
+    'Percent of adults who achieve at least 150 minutes a week of moderate-intensity aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic activity (or an equivalent combination)',
+    'Percent of adults who achieve at least 150 minutes a week of moderate-intensity aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic physical activity and engage in muscle-strengthening activities on 2 or more days a week',
+    'Percent of adults who achieve at least 300 minutes a week of moderate-intensity aerobic physical activity or 150 minutes a week of vigorous-intensity aerobic activity (or an equivalent combination)',
+    'Percent of adults who engage in muscle-strengthening activities on 2 or more days a week',
+]
+
+# The first five questions are "best is min", the others "best is max"
+NUM_QUESTIONS_BEST_IS_MIN = 5
+
+STRATIFICATIONS = (
+    [('Total', 'Total')] +
+    [('Age (years)', age) for age in ['18 - 24', '25 - 34', '35 - 44', '45 - 54', '55 - 64', '65 or older']] +
+    [('Sex', sex) for sex in ['Male', 'Female']] +
+    [('Education', education) for education in ['Less than high school', 'High school graduate',
+                                                 'Some college or technical school', 'College graduate']] +
+    [('Income', income) for income in ['Less than $15,000', '$15,000 - $24,999', '$25,000 - $34,999',
+                                       '$35,000 - $49,999', '$50,000 - $74,999', '$75,000 or greater',
+                                       'Data not reported']] +
+    [('Race/Ethnicity', race) for race in ['Non-Hispanic White', 'Non-Hispanic Black', 'Hispanic', 'Asian',
+                                           'American Indian/Alaska Native', 'Hawaiian/Pacific Islander',
+                                           '2 or more races', 'Other']]
+)
+
+CHUNK_ROWS = 1_000_000
+
+
+def generate(path, rows, num_states=55, num_questions=len(QUESTIONS), num_stratifications=len(STRATIFICATIONS),
+             seed=0):
+    '''
+    Write a CSV of rows random survey answers.
+
+    Returns the (questions_best_is_min, questions_best_is_max) lists of the
+    questions used, for building a DataIngestor on the file.
+    '''
+    rng = np.random.default_rng(seed)
+
+    questions = QUESTIONS[:num_questions] + [f'Synthetic question {index}'
+                                             for index in range(len(QUESTIONS), num_questions)]
+    states = np.array([f'State {index}' for index in range(num_states)], dtype=object)
+    categories = np.array([category for category, _ in STRATIFICATIONS[:num_stratifications]], dtype=object)
+    segments = np.array([segment for _, segment in STRATIFICATIONS[:num_stratifications]], dtype=object)
+    question_values = np.array(questions, dtype=object)
+
+    # Each (question, state) gets its own level so means differ between states
+    levels = rng.uniform(10, 60, size=(num_questions, num_states))
+
+    written = 0
+    while written < rows:
+        chunk = min(CHUNK_ROWS, rows - written)
+        question_index = rng.integers(num_questions, size=chunk)
+        state_index = rng.integers(num_states, size=chunk)
+        stratification_index = rng.integers(num_stratifications, size=chunk)
+        year = rng.integers(2011, 2023, size=chunk)
+        values = np.clip(levels[question_index, state_index] + rng.normal(0, 5, size=chunk), 0, 100).round(1)
+
+        pd.DataFrame({
+            'YearStart': year,
+            'YearEnd': year,
+            'LocationDesc': states[state_index],
+            'Question': question_values[question_index],
+            'Data_Value': values,
+            'StratificationCategory1': categories[stratification_index],
+            'Stratification1': segments[stratification_index],
+        }).to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += chunk
+
+    split = min(NUM_QUESTIONS_BEST_IS_MIN, num_questions)
+    return questions[:split], questions[split:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--states', type=int, default=55)
+    parser.add_argument('--questions', type=int, default=len(QUESTIONS))
+    parser.add_argument('--stratifications', type=int, default=len(STRATIFICATIONS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.path, args.rows, args.states, args.questions, args.stratifications, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measure request throughput of the server with 1 and N pre-forked processes.
+
+Each client thread submits a job to /api/states_mean and polls
+/api/get_results until it is done, so jobs are often polled from another
+process than the one they were submitted to.
+
+Run from the repository root (next to the dataset CSV):
+
+    python -m benchmarks.prefork_throughput
+"""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PORT = 5055
+CLIENTS = 16
+DURATION = 10
+PROCESSES = [1, os.cpu_count() or 1, 4]
+QUESTION = 'Percent of adults aged 18 years and older who have obesity'
+
+
+def request(connection, method, path, body=None):
+    '''
+    Send a request and decode the JSON response.
+    '''
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def client(deadline):
+    '''
+    Submit and poll jobs until the deadline, returning the number of requests made.
+    '''
+    connection = http.client.HTTPConnection('127.0.0.1', PORT)
+    requests = 0
+    while time.time() < deadline:
+        _, submitted = request(connection, 'POST', '/api/states_mean', {"question": QUESTION})
+        requests += 1
+        while True:
+            status, result = request(connection, 'GET', f"/api/get_results/{submitted['job_id']}")
+            requests += 1
+            if status == 200 and result["status"] == "done":
+                break
+        # Reconnect, so the next job may go to another process
+        connection.close()
+    return requests
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT)
+            request(connection, 'GET', '/api/num_jobs')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def main():
+    for processes in sorted(set(PROCESSES)):
+        server = subprocess.Popen([sys.executable, 'api_server.py', '--port', str(PORT), '--workers', str(processes)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server()
+            deadline = time.time() + DURATION
+            with ThreadPoolExecutor(CLIENTS) as executor:
+                total = sum(executor.map(client, [deadline] * CLIENTS))
+            print(f"{processes} process(es): {total / DURATION:.0f} requests/s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
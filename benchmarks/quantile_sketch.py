@@ -0,0 +1,70 @@
+"""
+Benchmark the precomputed quantile sketches against exact pandas quantiles.
+
+Run from the repository root (next to the dataset CSV):
+
+    python -m benchmarks.quantile_sketch
+"""
+import time
+
+from app import webserver
+
+QUANTILES = [0.5, 0.9]
+REPEATS = 20
+
+
+def exact_states_quantile(data, question, quantile):
+    '''
+    Per-state quantile computed on the raw frame, as a task would without sketches.
+    '''
+    relevant_data = data[data['Question'] == question]
+    return relevant_data.groupby('LocationDesc', observed=True)['Data_Value'].quantile(quantile, interpolation='lower').to_dict()
+
+
+def sketch_states_quantile(state_sketches, question, quantile):
+    '''
+    Per-state quantile answered from the precomputed per-state sketches.
+    '''
+    return {state: sketch.quantile(quantile) for state, sketch in state_sketches.get(question, {}).items()}
+
+
+def timed(func, *args):
+    '''
+    Average run time of func over REPEATS calls, with its last result.
+    '''
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = func(*args)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+def main():
+    ingestor = webserver.datasets.get()
+    questions = ingestor.questions_best_is_min + ingestor.questions_best_is_max
+
+    start = time.perf_counter()
+    sketches = ingestor.build_sketches()
+    state_sketches, _ = ingestor.merge_sketches(sketches)
+    print(f"sketch build: {time.perf_counter() - start:.3f}s for {len(ingestor.data)} rows")
+
+    for quantile in QUANTILES:
+        exact_time = sketch_time = 0.0
+        max_error = 0.0
+        for question in questions:
+            elapsed, exact = timed(exact_states_quantile, ingestor.data, question, quantile)
+            exact_time += elapsed
+            elapsed, estimated = timed(sketch_states_quantile, state_sketches, question, quantile)
+            sketch_time += elapsed
+
+            for state, value in exact.items():
+                if value:
+                    max_error = max(max_error, abs(estimated[state] - value) / abs(value))
+
+        print(f"q={quantile}: exact {exact_time * 1000:.2f}ms, sketch {sketch_time * 1000:.2f}ms, "
+              f"speedup {exact_time / sketch_time:.1f}x, max relative error {max_error:.4f}")
+
+    webserver.tasks_runner.stop()
+
+
+if __name__ == '__main__':
+    main()
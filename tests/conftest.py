@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.generate_dataset import generate
+
+# Importing the app package builds the server: keep its job log and results
+# out of the tree, and serve a small synthetic dataset
+state_dir = tempfile.mkdtemp()
+os.environ.setdefault('TP_JOB_LOG', os.path.join(state_dir, 'job_log.jsonl'))
+os.environ['TP_RESULTS_DIR'] = os.path.join(state_dir, 'results')
+
+csv_path = os.path.join(state_dir, 'synthetic.csv')
+questions_best_is_min, questions_best_is_max = generate(csv_path, 500, num_states=5)
+with open(os.path.join(state_dir, 'datasets.json'), mode='w', encoding='utf-8') as file:
+    json.dump({"synthetic": {"path": csv_path,
+                             "questions_best_is_min": questions_best_is_min,
+                             "questions_best_is_max": questions_best_is_max}}, file)
+os.environ['TP_DATASETS'] = os.path.join(state_dir, 'datasets.json')
+
+from app import webserver
+from app.dataset_registry import DatasetRegistry
+
+
+def pytest_sessionfinish(session, exitstatus):
+    '''
+    Stop the workers of the app's own pool so the process can exit.
+    '''
+    webserver.tasks_runner.stop()
+
+
+@pytest.fixture(scope='session')
+def datasets():
+    '''
+    Registry with a small synthetic dataset as its default one.
+    '''
+    registry = DatasetRegistry()
+    registry.register('synthetic', csv_path, questions_best_is_min, questions_best_is_max)
+    return registry
+
+
+@pytest.fixture
+def client():
+    '''
+    Test client of the app, serving the synthetic dataset.
+    '''
+    return webserver.test_client()
@@ -0,0 +1,34 @@
+import os
+
+from app.job_log import JobLog
+
+
+def job(job_id):
+    return {"job_id": job_id, "deadline": None, "task": {"type": "CalculateStatesMeanTask"}}
+
+
+def test_merge_folds_the_logs_of_every_process(tmp_path):
+    path = str(tmp_path / 'job_log.jsonl')
+    JobLog(path).save(4, [job(2)])
+    JobLog(path, '0').save(9, [job(7), job(5)])
+    JobLog(path, '3').save(8, [job(2), job(6)])
+
+    job_log = JobLog(path)
+    job_log.merge()
+
+    assert os.listdir(tmp_path) == ['job_log.jsonl']
+    id_counter, jobs = job_log.load()
+    assert id_counter == 9
+    assert [job["job_id"] for job in jobs] == [2, 5, 6, 7]
+
+
+def test_process_log_does_not_keep_main_log(tmp_path):
+    path = str(tmp_path / 'job_log.jsonl')
+    JobLog(path).save(1, [job(1)])
+
+    job_log = JobLog(path, '0')
+    assert job_log.load() == (1, [job(1)])
+    job_log.save(1, [])
+    job_log.discard()
+
+    assert os.listdir(tmp_path) == ['job_log.jsonl.0']
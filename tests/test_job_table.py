@@ -0,0 +1,84 @@
+from app.job_table import JobTable, STATUSES
+
+
+def job(status):
+    return {"status": status, "result": None}
+
+
+def list_all(table, status=None, limit=3):
+    '''
+    Follow the cursors of list_jobs until the last page.
+    '''
+    jobs, cursor = table.list_jobs(status, 0, limit)
+    while cursor is not None:
+        page, cursor = table.list_jobs(status, cursor, limit)
+        jobs += page
+    return jobs
+
+
+def test_counts_follow_every_change():
+    table = JobTable()
+    ids = [table.add(job("queued")) for _ in range(5)]
+    assert table.counts() == {**dict.fromkeys(STATUSES, 0), "queued": 5}
+
+    assert table.transition(ids[0], "queued", job("running"))
+    table.set(ids[1], job("done"))
+    table.delete(ids[2])
+
+    assert table.counts() == {**dict.fromkeys(STATUSES, 0), "queued": 2, "running": 1, "done": 1}
+    assert table.get(ids[2]) is None
+
+
+def test_transition_requires_status():
+    table = JobTable()
+    job_id = table.add(job("queued"))
+    table.set(job_id, job("running"))
+
+    assert not table.transition(job_id, "queued", job("cancelled"))
+    assert not table.transition(job_id + 1, "queued", job("cancelled"))
+    assert table.get(job_id)["status"] == "running"
+    assert table.count("cancelled") == 0
+
+
+def test_ids_after_reserve():
+    table = JobTable()
+    table.reserve_ids(41)
+    assert table.add(job("queued")) == 42
+    assert table.last_id() == 42
+
+
+def test_list_jobs_pages_in_id_order():
+    table = JobTable()
+    for index in range(10):
+        table.add(job("done" if index % 2 else "queued"))
+
+    first, cursor = table.list_jobs(None, 0, 4)
+    assert first == [(1, "queued"), (2, "done"), (3, "queued"), (4, "done")]
+    assert cursor == 4
+
+    assert [job_id for job_id, _ in list_all(table)] == list(range(1, 11))
+    assert list_all(table, "done") == [(job_id, "done") for job_id in range(2, 11, 2)]
+    assert table.list_jobs(None, 10, 4) == ([], None)
+
+
+def test_list_jobs_sparse_status():
+    table = JobTable()
+    for _ in range(1000):
+        table.add(job("done"))
+    table.set(7, job("error"))
+    table.set(993, job("error"))
+
+    assert list_all(table, "error", limit=1) == [(7, "error"), (993, "error")]
+    assert table.list_jobs("cancelled", 0, 10) == ([], None)
+    assert len(list_all(table, "done", limit=100)) == 998
+
+
+def test_list_jobs_in_id_order_whatever_the_transition_order():
+    table = JobTable()
+    ids = [table.add(job("running")) for _ in range(6)]
+    for job_id in reversed(ids):
+        table.set(job_id, job("done"))
+    table.delete(ids[2])
+
+    assert list_all(table, "done", limit=2) == [(job_id, "done") for job_id in ids if job_id != ids[2]]
+    assert [job_id for job_id, _ in list_all(table)] == [job_id for job_id in ids if job_id != ids[2]]
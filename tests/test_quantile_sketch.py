@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.quantile_sketch import QuantileSketch
+
+QUANTILES = [0, 0.01, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+
+def make_values(seed, size=2000):
+    '''
+    Positive, negative and zero values spread over several orders of magnitude.
+    '''
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(mean=2, sigma=2, size=size) * rng.choice([-1, 1], size=size, p=[0.2, 0.8])
+    values[:50] = 0
+    return values
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    values = make_values(0)
+    sketch = QuantileSketch.from_values(values, relative_accuracy)
+
+    for q in QUANTILES:
+        exact = np.quantile(values, q, method='lower')
+        assert abs(sketch.quantile(q) - exact) <= relative_accuracy * abs(exact) + 1e-12
+
+
+def test_add_values_matches_add():
+    values = make_values(1, size=300)
+    bulk = QuantileSketch.from_values(values)
+    single = QuantileSketch()
+    for value in values:
+        single.add(value)
+
+    assert bulk.positive == single.positive
+    assert bulk.negative == single.negative
+    assert (bulk.zero_count, bulk.count, bulk.min, bulk.max) == \
+           (single.zero_count, single.count, single.min, single.max)
+
+
+def test_merge_is_sketch_of_union():
+    first, second = make_values(2), make_values(3)
+    merged = QuantileSketch.from_values(first).merge(QuantileSketch.from_values(second))
+    union = QuantileSketch.from_values(np.concatenate([first, second]))
+
+    assert merged.positive == union.positive
+    assert merged.negative == union.negative
+    assert (merged.zero_count, merged.count, merged.min, merged.max) == \
+           (union.zero_count, union.count, union.min, union.max)
+    for q in QUANTILES:
+        assert merged.quantile(q) == union.quantile(q)
+
+
+def test_merged_of_several_sketches():
+    parts = [make_values(seed, size=100) for seed in range(5)]
+    merged = QuantileSketch.merged(QuantileSketch.from_values(part) for part in parts)
+
+    assert merged.count == sum(len(part) for part in parts)
+    assert merged.quantile(0.5) == QuantileSketch.from_values(np.concatenate(parts)).quantile(0.5)
+
+
+def test_merge_rejects_other_accuracy():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+
+def test_empty_sketch_and_nan():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+
+    sketch.add_values([float('nan'), 3.0])
+    sketch.add(float('nan'))
+    assert sketch.count == 1
+    assert sketch.quantile(0.5) == pytest.approx(3.0, rel=0.01)
+
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
@@ -0,0 +1,195 @@
+import json
+import time
+
+import pytest
+
+from app import webserver
+
+QUESTION = webserver.datasets.get().questions_best_is_min[0]
+
+
+def submit(client, endpoint, data):
+    '''
+    Submit a job and return its id.
+    '''
+    response = client.post(f'/api/{endpoint}', json=data)
+    assert response.status_code == 202
+    return response.get_json()["job_id"]
+
+
+def wait_result(client, job_id, **args):
+    '''
+    Wait for a job to finish and return its result response.
+    '''
+    deadline = time.time() + 5
+    while client.get(f'/api/get_results/{job_id}').get_json()["status"] == "running":
+        assert time.time() < deadline, "job not finished in time"
+        time.sleep(0.01)
+    return client.get(f'/api/get_results/{job_id}', query_string=args)
+
+
+def test_cancel_job(client):
+    # A job nothing will pick up, as if workers were busy
+    job_id = webserver.tasks_runner.jobs.add({"status": "queued", "result": None, "deadline": None})
+
+    assert client.delete(f'/api/jobs/{job_id}').get_json() == {"status": "cancelled"}
+    assert client.get(f'/api/get_results/{job_id}').get_json() == {"status": "cancelled"}
+
+    done_id = submit(client, 'states_mean', {"question": QUESTION})
+    wait_result(client, done_id)
+    response = client.delete(f'/api/jobs/{done_id}')
+    assert response.status_code == 409
+    assert response.get_json()["status"] == "done"
+
+
+@pytest.mark.parametrize('job_id', ['123456789', 'abc', '-1'])
+def test_cancel_unknown_job(client, job_id):
+    response = client.delete(f'/api/jobs/{job_id}')
+    assert response.status_code == 404
+    assert response.get_json() == {"status": "not_found"}
+
+
+@pytest.fixture
+def views():
+    '''
+    Materialize the views of the default dataset for one test.
+    '''
+    webserver.views.build()
+    yield webserver.views
+    webserver.views.snapshot = (None, {})
+
+
+def test_view_revalidated_by_etag(client, views):
+    response = client.get('/api/views/states_mean', query_string={"question": QUESTION})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+
+    job_id = submit(client, 'states_mean', {"question": QUESTION})
+    assert client.get(f'/api/get_results/{job_id}').get_json() == response.get_json()
+
+    response = client.get('/api/views/states_mean', query_string={"question": QUESTION},
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_view_not_materialized(client, views):
+    assert client.get('/api/views/unknown', query_string={"question": QUESTION}).status_code == 404
+    assert client.get('/api/views/states_mean', query_string={"question": "unknown"}).status_code == 404
+
+    views.snapshot = (None, {})
+    assert client.get('/api/views/states_mean', query_string={"question": QUESTION}).status_code == 404
+
+
+def test_profile_collapsed_stacks(client):
+    response = client.get('/api/admin/profile', query_string={"duration": 0.05, "interval": 0.01})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        root = stack.split(';', 1)[0]
+        assert (root == 'idle' or root.endswith('Task')) and int(count) > 0
+
+
+def test_profile_rejects_bad_arguments_and_overlaps(client):
+    for args in ({"duration": 0}, {"duration": 61}, {"duration": 1, "interval": 0.0001}):
+        assert client.get('/api/admin/profile', query_string=args).status_code == 400
+
+    with webserver.profiler.busy:
+        assert client.get('/api/admin/profile', query_string={"duration": 0.05}).status_code == 409
+
+
+def test_datasets_listed_and_selected(client):
+    job_id = submit(client, 'states_mean', {"question": QUESTION, "dataset": "synthetic"})
+    assert wait_result(client, job_id).get_json()["status"] == "done"
+
+    datasets = client.get('/api/datasets').get_json()["datasets"]
+    assert len(datasets) == 1
+    assert datasets[0]["name"] == "synthetic" and datasets[0]["default"] and datasets[0]["loaded"]
+    assert datasets[0]["memory_usage"] > 0
+
+    response = client.post('/api/states_mean', json={"question": QUESTION, "dataset": "unknown"})
+    assert response.status_code == 400
+    assert response.get_json() == {"status": "error", "message": "Invalid dataset"}
+
+
+def test_catalog_ids_with_version(client):
+    catalog = client.get('/api/catalog').get_json()
+    assert catalog["version"] == webserver.datasets.get().version
+    question_id = next(entry["id"] for entry in catalog["questions"] if entry["question"] == QUESTION)
+    state = catalog["states"][0]
+
+    by_id = submit(client, 'state_mean', {"question": question_id, "state": state["id"],
+                                          "version": catalog["version"]})
+    by_name = submit(client, 'state_mean', {"question": QUESTION, "state": state["state"]})
+    assert wait_result(client, by_id).get_json() == wait_result(client, by_name).get_json()
+
+    response = client.post('/api/state_mean', json={"question": question_id, "state": state["id"],
+                                                     "version": "0" * 16})
+    assert response.status_code == 400
+    assert response.get_json()["version"] == catalog["version"]
+
+
+def read_pages(client, job_id, limit):
+    '''
+    Follow the cursors of a result until its last page.
+    '''
+    rows, cursor = {}, 0
+    while cursor is not None:
+        page = client.get(f'/api/get_results/{job_id}', query_string={"cursor": cursor, "limit": limit}).get_json()
+        assert len(page["data"]) <= limit
+        rows.update(page["data"])
+        cursor = page["next_cursor"]
+    return rows
+
+
+@pytest.mark.parametrize('endpoint', ['mean_by_category', 'states_mean'])
+def test_results_as_ndjson_and_pages(client, endpoint):
+    # mean_by_category streams its rows to a file, states_mean keeps a dict
+    job_id = submit(client, endpoint, {"question": QUESTION})
+    result = wait_result(client, job_id).get_json()["data"]
+    assert len(result) > 3
+    assert webserver.tasks_runner.jobs.get(job_id).get("streamed", False) == (endpoint == 'mean_by_category')
+
+    response = client.get(f'/api/get_results/{job_id}', query_string={"format": "ndjson"})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert {line["key"]: line["value"] for line in lines} == result
+
+    assert read_pages(client, job_id, 3) == result
+
+
+def test_results_bad_cursor_and_id(client):
+    job_id = submit(client, 'mean_by_category', {"question": QUESTION})
+    wait_result(client, job_id)
+
+    response = client.get(f'/api/get_results/{job_id}', query_string={"cursor": 1})
+    assert response.status_code == 400
+    assert response.get_json() == {"status": "error", "message": "Invalid cursor"}
+
+    assert client.get('/api/get_results/abc').status_code == 404
+
+
+def test_jobs_filtered_and_paged(client):
+    job_ids = [submit(client, 'global_mean', {"question": QUESTION}) for _ in range(3)]
+    for job_id in job_ids:
+        wait_result(client, job_id)
+
+    page = client.get('/api/jobs', query_string={"status": "done", "cursor": job_ids[0] - 1, "limit": 2}).get_json()
+    assert page["jobs"] == [{"job_id": job_id, "status": "done"} for job_id in job_ids[:2]]
+    assert page["next_cursor"] == job_ids[1]
+
+    page = client.get('/api/jobs', query_string={"cursor": job_ids[1], "limit": 1}).get_json()
+    assert page["jobs"] == [{"job_id": job_ids[2], "status": "done"}]
+
+    assert client.get('/api/jobs', query_string={"status": "cancelled", "cursor": job_ids[0] - 1}).get_json() == \
+        {"status": "success", "jobs": [], "next_cursor": None}
+    assert client.get('/api/jobs', query_string={"status": "unknown"}).status_code == 400
+
+    counts = client.get('/api/num_jobs').get_json()
+    assert counts["remaining_jobs"] == counts["queued"] + counts["running"]
+    assert counts["done"] >= 3
@@ -0,0 +1,256 @@
+import os
+import time
+from threading import Event
+
+import pytest
+
+from app import task_runner
+from app.job_log import JobLog
+from app.task import CalculateStatesMeanTask, serialize_task, restore_task
+from app.task_runner import ThreadPool
+
+
+class BlockingTask:
+    '''
+    Task that runs until its release event is set.
+    '''
+    def __init__(self, release):
+        self.release = release
+        self.started = Event()
+
+    def execute(self):
+        self.started.set()
+        self.release.wait(10)
+        return {"done": True}
+
+
+def wait_for(condition, timeout=5):
+    '''
+    Wait until condition() is true, failing the test after timeout seconds.
+    '''
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def release():
+    '''
+    Event releasing the blocking tasks, set at teardown whatever happens.
+    '''
+    event = Event()
+    yield event
+    event.set()
+
+
+@pytest.fixture
+def make_pool(monkeypatch, tmp_path, release):
+    '''
+    Build pools saving their results under tmp_path, stopped at teardown.
+    '''
+    monkeypatch.setattr(task_runner, 'RESULTS_DIR', tmp_path / 'results')
+    pools = []
+
+    def make(num_threads=1, min_threads=1, idle_timeout=5):
+        monkeypatch.setenv('TP_NUM_OF_THREADS', str(num_threads))
+        monkeypatch.setenv('TP_MIN_THREADS', str(min_threads))
+        monkeypatch.setenv('TP_IDLE_TIMEOUT', str(idle_timeout))
+        pool = ThreadPool()
+        pools.append(pool)
+        return pool
+
+    yield make
+
+    release.set()
+    for pool in pools:
+        pool.stop()
+        for worker in list(pool.threads.values()):
+            worker.join(5)
+
+
+def status(pool, job_id):
+    return pool.jobs.get(job_id)["status"]
+
+
+def test_task_runs_and_result_is_saved(make_pool, release):
+    pool = make_pool()
+    pool.start()
+    release.set()
+
+    job_id = pool.add_task(BlockingTask(release))
+    wait_for(lambda: status(pool, job_id) == "done")
+
+    assert pool.jobs.get(job_id)["result"] == {"done": True}
+    assert pool.load_result(job_id)["result"] == {"done": True}
+
+
+def test_failing_task_ends_in_error(make_pool):
+    class FailingTask:
+        def execute(self):
+            raise ValueError("no rows")
+
+    pool = make_pool()
+    pool.start()
+
+    job_id = pool.add_task(FailingTask())
+    wait_for(lambda: status(pool, job_id) != "queued" and status(pool, job_id) != "running")
+    assert status(pool, job_id) == "error"
+    wait_for(lambda: pool.load_result(job_id) is not None)
+    assert pool.load_result(job_id)["status"] == "error"
+
+
+def test_streamed_result_is_saved_once_complete(make_pool, release):
+    class RowsTask(BlockingTask):
+        def validate_input(self):
+            return None
+
+        def iter_rows(self):
+            yield "first", 1
+            self.started.set()
+            self.release.wait(10)
+            yield "second", 2
+
+    pool = make_pool()
+    pool.start()
+    task = RowsTask(release)
+    job_id = pool.add_task(task)
+    wait_for(task.started.is_set)
+
+    # A result still being written is not reported as saved
+    assert pool.load_result(job_id) is None
+
+    release.set()
+    wait_for(lambda: status(pool, job_id) == "done")
+    task_info = pool.load_result(job_id)
+    assert task_info["streamed"]
+    assert pool.result_page(job_id, task_info, 0, 10) == ([("first", 1), ("second", 2)], None)
+    assert "".join(pool.stream_result(job_id)).count("\n") == 2
+
+
+def test_expired_task_is_skipped(make_pool, release):
+    pool = make_pool()
+    task = BlockingTask(release)
+    job_id = pool.add_task(task, timeout=0)
+    time.sleep(0.01)
+
+    pool.start()
+    wait_for(lambda: status(pool, job_id) != "queued")
+
+    assert status(pool, job_id) == "expired"
+    assert not task.started.is_set()
+    # Saved right after the status changes in the table
+    wait_for(lambda: pool.load_result(job_id) is not None)
+    assert pool.load_result(job_id)["status"] == "expired"
+
+
+def test_cancel_task(make_pool, release):
+    pool = make_pool()
+    cancelled = BlockingTask(release)
+    cancelled_id = pool.add_task(cancelled)
+    assert pool.cancel_task(cancelled_id) == "cancelled"
+
+    release.set()
+    pool.start()
+    done_id = pool.add_task(BlockingTask(release))
+    wait_for(lambda: status(pool, done_id) == "done")
+
+    assert status(pool, cancelled_id) == "cancelled"
+    assert not cancelled.started.is_set()
+    assert pool.cancel_task(done_id) == "done"
+    assert pool.cancel_task(done_id + 1) is None
+    assert pool.load_result(cancelled_id)["status"] == "cancelled"
+
+
+def test_pool_grows_and_shrinks(make_pool, release):
+    pool = make_pool(num_threads=4, min_threads=1, idle_timeout=0.1)
+    pool.start()
+    assert len(pool.threads) == 1
+
+    tasks = [BlockingTask(release) for _ in range(8)]
+    job_ids = [pool.add_task(task) for task in tasks]
+    wait_for(lambda: len(pool.threads) == 4)
+    wait_for(lambda: sum(task.started.is_set() for task in tasks) == 4)
+
+    release.set()
+    wait_for(lambda: all(status(pool, job_id) == "done" for job_id in job_ids))
+    wait_for(lambda: len(pool.threads) == 1)
+
+
+def test_pool_grows_for_task_stuck_behind_long_one(make_pool, release):
+    pool = make_pool(num_threads=2, min_threads=1)
+    pool.start()
+    long_task = BlockingTask(release)
+    pool.add_task(long_task)
+    wait_for(long_task.started.is_set)
+
+    # No task comes after this one to trigger growth
+    stuck = BlockingTask(release)
+    pool.add_task(stuck)
+    wait_for(stuck.started.is_set)
+    assert len(pool.threads) == 2
+
+
+def test_shutdown_returns_queued_tasks(make_pool, release):
+    pool = make_pool()
+    pool.start()
+    blocker = BlockingTask(release)
+    pool.add_task(blocker)
+    wait_for(blocker.started.is_set)
+
+    queued_ids = [pool.add_task(BlockingTask(release), timeout=60) for _ in range(3)]
+    remaining = pool.shutdown(0.1)
+
+    assert [task_id for _, task_id, _ in remaining] == queued_ids
+    assert all(deadline is not None for _, _, deadline in remaining)
+    assert pool.add_task(BlockingTask(release)) is None
+
+
+def test_shutdown_persists_queued_tasks(make_pool, release, datasets, tmp_path):
+    data_ingestor = datasets.get()
+    question = data_ingestor.questions_best_is_min[0]
+
+    pool = make_pool()
+    pool.start()
+    blocker = BlockingTask(release)
+    pool.add_task(blocker)
+    wait_for(blocker.started.is_set)
+    queued_id = pool.add_task(CalculateStatesMeanTask(question, data_ingestor))
+
+    # What /api/graceful_shutdown does
+    job_log = JobLog(str(tmp_path / 'job_log.jsonl'))
+    queued_tasks = pool.shutdown(0.1)
+    job_log.save(pool.jobs.last_id(), [{"job_id": task_id, "deadline": deadline, "task": serialize_task(task)}
+                                       for task, task_id, deadline in queued_tasks])
+
+    # What the next start does
+    restarted = make_pool()
+    job_log = JobLog(job_log.path)
+    id_counter, jobs = job_log.load()
+    restarted.restore(id_counter, [(restore_task(job["task"], datasets), job["job_id"], job["deadline"])
+                                   for job in jobs])
+    job_log.discard_when_done(restarted.jobs, [job["job_id"] for job in jobs], interval=0.01)
+
+    # Kept until the replayed job is done, in case the server stops before
+    assert os.path.exists(job_log.path)
+    restarted.start()
+
+    wait_for(lambda: status(restarted, queued_id) == "done")
+    assert restarted.jobs.get(queued_id)["result"] == CalculateStatesMeanTask(question, data_ingestor).execute()
+    assert restarted.add_task(CalculateStatesMeanTask(question, data_ingestor)) == id_counter + 1
+    wait_for(lambda: not os.path.exists(job_log.path))
+
+
+def test_restore_after_crash(make_pool, release):
+    pool = make_pool()
+    pool.start()
+    release.set()
+    job_ids = [pool.add_task(BlockingTask(release)) for _ in range(3)]
+    wait_for(lambda: all(status(pool, job_id) == "done" for job_id in job_ids))
+
+    # No id counter was saved, and the log still holds a job that ran since
+    restarted = make_pool()
+    restarted.restore(0, [(BlockingTask(release), job_ids[0], None)])
+
+    assert restarted.jobs.get(job_ids[0]) is None
+    assert restarted.add_task(BlockingTask(release)) == job_ids[-1] + 1